@@ -5,28 +5,48 @@ Kompleksnyy bot dlya upravleniya institutsionalnymi zayavkami s rolyami administ
 """
 
 import asyncio
+import contextvars
+import functools
+import hashlib
+import itertools
+import json
 import logging
-from datetime import datetime, timedelta
-from typing import Optional, List
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Optional, List, Any, Awaitable, Callable, Dict
 import os
+import shutil
+import sqlite3
+import sys
+import tempfile
 from dataclasses import dataclass
 
 # Third-party imports
-from aiogram import Bot, Dispatcher, F, Router
+from aiohttp import web, ClientSession
+from aiogram import Bot, Dispatcher, F, Router, BaseMiddleware
 from aiogram.types import (
     Message, CallbackQuery, KeyboardButton, ReplyKeyboardMarkup,
-    InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
+    InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile, TelegramObject, Update
 )
-from aiogram.filters import Command, StateFilter
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Boolean, Text
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from sqlalchemy import create_engine, event, select, text, case, literal, or_, tuple_, type_coerce, union_all, Column, Integer, String, Date, DateTime, Float, ForeignKey, Boolean, Text, Index
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker, Session, relationship, declarative_base
 from sqlalchemy.sql import func
+import numpy as np
 import pandas as pd
 from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.platypus import SimpleDocTemplate, Table, LongTable, TableStyle, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.lib import colors
@@ -39,11 +59,62 @@ class Config:
     ADMIN_IDS: List[int] = None # Super Admin ID'lari
     DATABASE_URL: str = "sqlite:///requests.db"
     REPORTS_DIR: str = "reports"
+    USE_WEBHOOK: bool = False  # True - webhook (aiohttp server), False - long polling
+    WEBHOOK_BASE_URL: str = ""  # Tashqi manzil, masalan https://bot.example.uz; bo'sh bo'lsa setWebhook chaqirilmaydi
+    WEBHOOK_PATH: str = "/webhook"
+    WEBHOOK_SECRET: str = ""  # X-Telegram-Bot-Api-Secret-Token sarlavhasi tekshiriladi
+    WEBAPP_HOST: str = "0.0.0.0"
+    WEBAPP_PORT: int = 8080
+    WEBHOOK_MAX_CONNECTIONS: int = 40  # Telegram'ning webhook'ga parallel ulanishlari (1-100)
+    MAX_CONCURRENT_UPDATES: int = 64  # Bir vaqtda qayta ishlanadigan update'lar
+    WORKERS: int = 1  # Webhook rejimida bitta portni bo'lishadigan jarayonlar soni
+    CACHE_SYNC_INTERVAL: float = 1.0  # Soniya, boshqa jarayonlardagi o'zgarishlarni tekshirish oralig'i
+    UPDATE_DEDUP_HOURS: int = 24  # Qayta ishlangan update_id'lar shuncha vaqt saqlanadi
+    DB_WORKERS: int = 4  # Bazaga so'rovlar bajaradigan oqimlar soni
+    DB_POOL_SIZE: int = 8  # Doimiy ochiq turadigan ulanishlar (DB_WORKERS + fon vazifalari)
+    DB_POOL_OVERFLOW: int = 4  # Vaqtincha qo'shimcha ochiladigan ulanishlar
+    DB_POOL_TIMEOUT: int = 30  # Soniya, bo'sh ulanishni kutish
+    SQLITE_JOURNAL_MODE: str = "WAL"  # WAL: o'qishlar yozuvlarni bloklamaydi va aksincha
+    SQLITE_SYNCHRONOUS: str = "NORMAL"  # WAL bilan xavfsiz; fsync faqat checkpoint'da
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000  # Qulf band bo'lsa shuncha kutiladi, keyin "database is locked"
+    SQLITE_MMAP_SIZE_MB: int = 256
+    SQLITE_CACHE_SIZE_MB: int = 64  # Har bir ulanishning sahifa keshi
+    SQLITE_TEMP_STORE: str = "MEMORY"  # Saralash/vaqtinchalik jadvallar xotirada
+    WRITE_BATCH_DELAY_MS: float = 5.0  # Ariza yozuvlari shuncha vaqt yig'ilib, bitta commit qilinadi
+    WRITE_BATCH_SIZE: int = 100  # Bitta commit'dagi yozuvlar soni
+    USER_CACHE_SIZE: int = 10000  # Keshdagi foydalanuvchilar soni
+    USER_CACHE_TTL: int = 300  # Soniya
+    STATS_CACHE_TTL: int = 30  # Soniya, statistika ekranlari shu vaqt keshdan beriladi
+    REQUESTS_PAGE_SIZE: int = 10  # Arizalar ro'yxatining bitta sahifasidagi arizalar
+    NOTIFY_WORKERS: int = 8  # Bir vaqtda xabar yuboradigan vazifalar
+    NOTIFY_GLOBAL_RATE: float = 25.0  # Barcha chatlarga jami, xabar/soniya
+    NOTIFY_CHAT_RATE: float = 1.0  # Bitta chatga, xabar/soniya
+    NOTIFY_MAX_RETRIES: int = 3  # RetryAfter'dan keyin qayta urinishlar
+    OUTBOX_BATCH_SIZE: int = 100  # Outbox'dan bir martada olinadigan xabarlar
+    OUTBOX_POLL_INTERVAL: float = 5.0  # Soniya, yangi xabarlarni tekshirish oralig'i
+    OUTBOX_MAX_ATTEMPTS: int = 5  # Shundan keyin xabar 'failed' bo'ladi
+    OUTBOX_RETRY_BASE_SECONDS: float = 30.0  # Muvaffaqiyatsiz urinishdan keyingi kutish, har safar 2 baravar
+    OUTBOX_RETRY_MAX_SECONDS: float = 3600.0  # Kutishning yuqori chegarasi
+    OUTBOX_RETENTION_DAYS: int = 7  # Yuborilgan xabarlar shuncha kun saqlanadi
+    FSM_FLUSH_INTERVAL: float = 1.0  # Soniya, FSM o'zgarishlari bazaga shu oraliqda yoziladi
+    FSM_STATE_TTL_HOURS: int = 24  # Shuncha vaqt ishlatilmagan FSM holatlari o'chiriladi
+    FSM_CACHE_SIZE: int = 10000  # Xotirada saqlanadigan FSM holatlari soni
+    BLOCKED_RETRY_HOURS: int = 24  # Botni bloklagan chatga shundan keyin yana urinib ko'riladi
+    REPORT_WORKERS: int = 2  # PDF hisobotlarni yaratadigan jarayonlar soni
+    REPORT_CACHE_MAX_MB: int = 200  # reports papkasining maksimal hajmi
+    REPORT_CACHE_MAX_AGE_DAYS: int = 30  # Bundan eski hisobot fayllari o'chiriladi
+    SLA_RESPONSE_HOURS: float = 4.0  # Arizaga birinchi javob muddati
+    SLA_RESOLUTION_HOURS: float = 24.0  # Arizani hal qilish muddati
+    REPORT_TABLE_ROWS: int = 50  # Hisobotdagi bitta jadval bo'lagidagi qatorlar (taxminan bir sahifa)
 
     def __post_init__(self):
         if self.ADMIN_IDS is None:
             self.ADMIN_IDS = [584323689]  # Zamenite na realnyy ID Super administratora
 
+        # Long polling'da getUpdates'ni faqat bitta jarayon chaqira oladi
+        if not self.USE_WEBHOOK:
+            self.WORKERS = 1
+
         # Sozdaniye papki dlya otchetov, yesli ona ne sushchestvuyet
         os.makedirs(self.REPORTS_DIR, exist_ok=True)
 
@@ -90,10 +161,127 @@ class Request(Base):
     resolution_details = Column(Text, nullable=True) # Texnikning izohi: nima qilingani, sababi
     pc_number = Column(String(50), nullable=True) # Kompyuter raqami
     resolved_by_user_id = Column(Integer, ForeignKey('users.id'), nullable=True) # Kim bajargani
+    first_response_at = Column(DateTime, nullable=True)  # Status birinchi marta 'pending'dan o'zgargan vaqt
+    resolved_at = Column(DateTime, nullable=True)  # completed / not_completed bo'lgan vaqt
 
     user = relationship("User", back_populates="requests", foreign_keys=[user_id])
     resolver = relationship("User", foreign_keys=[resolved_by_user_id]) # Yangi relationship
 
+    # Texnik/admin ro'yxatlari, statistika va hisobotlardagi filtrlarga mos indekslar
+    __table_args__ = (
+        Index('ix_requests_institution_status_created', 'institution', 'status', 'created_at'),
+        Index('ix_requests_status_created', 'status', 'created_at'),
+        # Admin ro'yxati mintaqa/tuman filtri bilan: sahifa filtrlangan arizalardan tartib bilan o'qiladi
+        Index('ix_requests_status_region_created', 'status', 'region', 'created_at'),
+        Index('ix_requests_status_region_district_created', 'status', 'region', 'district', 'created_at'),
+        Index('ix_requests_user_created', 'user_id', 'created_at'),
+        Index('ix_requests_created_at', 'created_at'),
+    )
+
+
+# Outbox: xabarlar ariza bilan bitta tranzaksiyada yoziladi va fon vazifasi tomonidan yuboriladi
+class OutboxMessage(Base):
+    __tablename__ = 'outbox'
+
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(Integer, nullable=False)
+    text = Column(Text, nullable=False)
+    status = Column(String(20), default='pending')  # pending, sent, failed, skipped
+    attempts = Column(Integer, default=0)
+    created_at = Column(DateTime, default=func.now())
+    sent_at = Column(DateTime, nullable=True)
+    next_attempt_at = Column(DateTime, nullable=True)  # Muvaffaqiyatsiz urinishdan keyin shu vaqtgacha olinmaydi
+
+    __table_args__ = (
+        Index('ix_outbox_status_id', 'status', 'id'),
+    )
+
+
+# Botni bloklagan yoki topilmagan chatlar (fan-out paytida o'tkazib yuboriladi)
+class BlockedChat(Base):
+    __tablename__ = 'blocked_chats'
+
+    chat_id = Column(Integer, primary_key=True, autoincrement=False)
+    reason = Column(String(200), nullable=True)
+    blocked_at = Column(DateTime, nullable=False)
+
+
+# Ariza statuslari tarixi (faqat qo'shiladi): har bir o'tishda bitta qator
+class RequestEvent(Base):
+    __tablename__ = 'request_events'
+
+    id = Column(Integer, primary_key=True)
+    request_id = Column(Integer, ForeignKey('requests.id'), nullable=False)
+    status = Column(String(20), nullable=False)
+    actor_user_id = Column(Integer, ForeignKey('users.id'), nullable=True)  # Kim o'zgartirgani
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index('ix_request_events_request_id', 'request_id', 'id'),
+        Index('ix_request_events_status_created', 'status', 'created_at'),
+        Index('ix_request_events_created_at', 'created_at'),
+    )
+
+
+# Kunlik agregatlar: kun x hudud x muassasa x status bo'yicha arizalar soni va hal qilish vaqti.
+# Ariza yaratilganda va statusi o'zgarganda yangilanadi; uzoq davr hisobotlari shu jadvaldan o'qiladi.
+class RequestDailyStat(Base):
+    __tablename__ = 'request_daily_stats'
+
+    day = Column(Date, primary_key=True)  # Ariza yaratilgan kun
+    region = Column(String(100), primary_key=True)
+    district = Column(String(100), primary_key=True)
+    institution = Column(String(200), primary_key=True)
+    status = Column(String(20), primary_key=True)
+    requests_count = Column(Integer, nullable=False, default=0)
+    resolved_count = Column(Integer, nullable=False, default=0)  # completed / not_completed
+    resolution_seconds = Column(Float, nullable=False, default=0.0)  # Yaratilgandan hal qilingungacha, jami
+    updated_at = Column(DateTime, nullable=False)
+
+
+RESOLVED_STATUSES = ('completed', 'not_completed')
+ACTIVE_STATUSES = ('pending', 'in_progress')
+
+
+# Telegram'ga yuklangan hisobotlar: fayl nomi (davr + versiya) -> file_id, qayta yuklamaslik uchun
+class ReportFile(Base):
+    __tablename__ = 'report_files'
+
+    filename = Column(String(200), primary_key=True)
+    file_id = Column(String(200), nullable=False)
+    created_at = Column(DateTime, default=func.now())
+
+
+# FSM holatlari (yarim to'ldirilgan ro'yxatdan o'tish/ariza), qayta ishga tushirishda yo'qolmasligi uchun
+class FsmRecord(Base):
+    __tablename__ = 'fsm_states'
+
+    key = Column(String(200), primary_key=True)
+    state = Column(String(200), nullable=True)
+    data = Column(Text, nullable=False, default='{}')  # JSON
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_fsm_states_updated_at', 'updated_at'),
+    )
+
+
+# Qayta ishlangan update'lar: Telegram qayta yuborgan update ikkinchi marta bajarilmaydi
+class ProcessedUpdate(Base):
+    __tablename__ = 'processed_updates'
+
+    update_id = Column(Integer, primary_key=True, autoincrement=False)
+    created_at = Column(DateTime, nullable=False, index=True)
+
+
+# Jarayonlar o'rtasida kesh versiyalari: ma'lumot o'zgarganda generation oshiriladi,
+# boshqa worker'lar buni ko'rib o'z keshini qayta yuklaydi
+class CacheGeneration(Base):
+    __tablename__ = 'cache_generations'
+
+    name = Column(String(50), primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
+
 
 class Region(Base):
     __tablename__ = 'regions'
@@ -107,7 +295,7 @@ class District(Base):
     __tablename__ = 'districts'
 
     id = Column(Integer, primary_key=True)
-    name = Column(String(100), nullable=False)
+    name = Column(String(100), nullable=False, index=True)
     region_id = Column(Integer, ForeignKey('regions.id'), nullable=False)
     is_active = Column(Boolean, default=True)
 
@@ -118,7 +306,7 @@ class Institution(Base):
     __tablename__ = 'institutions'
 
     id = Column(Integer, primary_key=True)
-    name = Column(String(200), nullable=False)
+    name = Column(String(200), nullable=False, index=True)
     district_id = Column(Integer, ForeignKey('districts.id'), nullable=False)
     is_active = Column(Boolean, default=True)
 
@@ -126,9 +314,169 @@ class Institution(Base):
 
 
 # Nastrojka baz dannykh
-engine = create_engine(config.DATABASE_URL, echo=False)
+def sqlite_pragmas() -> dict:
+    return {
+        'journal_mode': config.SQLITE_JOURNAL_MODE,
+        'synchronous': config.SQLITE_SYNCHRONOUS,
+        'busy_timeout': config.SQLITE_BUSY_TIMEOUT_MS,
+        'mmap_size': config.SQLITE_MMAP_SIZE_MB * 1024 * 1024,
+        'cache_size': -config.SQLITE_CACHE_SIZE_MB * 1024,  # manfiy qiymat - KiB
+        'temp_store': config.SQLITE_TEMP_STORE,
+    }
+
+
+def create_db_engine(url: str, pragmas: dict):
+    """pragmas har bir yangi SQLite ulanishida qo'llanadi (journal_mode fayl uchun saqlanib qoladi)"""
+    # Sessiyalar DB oqimlarida ishlatiladi, shuning uchun check_same_thread o'chirilgan
+    db_engine = create_engine(
+        url, echo=False, connect_args={"check_same_thread": False},
+        pool_size=config.DB_POOL_SIZE, max_overflow=config.DB_POOL_OVERFLOW, pool_timeout=config.DB_POOL_TIMEOUT
+    )
+
+    @event.listens_for(db_engine, "connect")
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return db_engine
+
+
+def begin_write(db: Session) -> None:
+    """Yozish tranzaksiyasini yozuv qulfi bilan boshlash (sessiyadagi birinchi so'rovdan oldin).
+
+    pysqlite o'qishlarni tranzaksiyasiz bajaradi, BEGIN'ni esa faqat birinchi DML oldidan yuboradi:
+    SAVEPOINT'dan oldin yubormaydi, o'qib-keyin-yozadigan funksiyalar esa o'qishdan keyin boshqa
+    ulanish commit qilgan o'zgarishlarni ko'rmaydi. BEGIN IMMEDIATE qulfni boshida oladi (band bo'lsa
+    busy_timeout kutadi), shundan keyingi o'qish va yozuvlar bitta tranzaksiyada bo'ladi."""
+    db.connection().exec_driver_sql("BEGIN IMMEDIATE")
+
+
+engine = create_db_engine(config.DATABASE_URL, sqlite_pragmas())
+
+
+# Sxema migratsiyalari. create_all faqat yangi jadvallarni yaratadi, mavjud
+# jadvallarga qo'shilgan indeks va ustunlar shu ro'yxat orqali tartib bilan qo'llanadi.
+MIGRATIONS = [
+    (1, [
+        "CREATE INDEX IF NOT EXISTS ix_requests_institution_status_created ON requests (institution, status, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_requests_status_created ON requests (status, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_requests_user_created ON requests (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_requests_created_at ON requests (created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_districts_name ON districts (name)",
+        "CREATE INDEX IF NOT EXISTS ix_institutions_name ON institutions (name)",
+    ]),
+    # Mavjud arizalardan kunlik agregatlarni to'ldirish
+    (2, [
+        "INSERT OR IGNORE INTO request_daily_stats "
+        "(day, region, district, institution, status, requests_count, resolved_count, resolution_seconds, updated_at) "
+        "SELECT date(created_at), region, district, institution, COALESCE(status, 'pending'), COUNT(*), "
+        "SUM(CASE WHEN status IN ('completed', 'not_completed') THEN 1 ELSE 0 END), "
+        "SUM(CASE WHEN status IN ('completed', 'not_completed') "
+        "THEN (julianday(updated_at) - julianday(created_at)) * 86400 ELSE 0 END), "
+        "CURRENT_TIMESTAMP "
+        "FROM requests GROUP BY 1, 2, 3, 4, 5",
+    ]),
+    # Javob va hal qilish vaqtlari; eski arizalar uchun updated_at taxminiy qiymat sifatida olinadi
+    (3, [
+        lambda conn: add_column_if_missing(conn, 'requests', 'first_response_at', 'DATETIME'),
+        lambda conn: add_column_if_missing(conn, 'requests', 'resolved_at', 'DATETIME'),
+        "UPDATE requests SET first_response_at = updated_at "
+        "WHERE first_response_at IS NULL AND status != 'pending'",
+        "UPDATE requests SET resolved_at = updated_at "
+        "WHERE resolved_at IS NULL AND status IN ('completed', 'not_completed')",
+    ]),
+    # Mavjud arizalar uchun tarix: yaratilish va oxirgi holat (oraliq o'tishlar tiklanmaydi)
+    (4, [
+        "INSERT INTO request_events (request_id, status, actor_user_id, created_at) "
+        "SELECT id, 'pending', user_id, created_at FROM requests",
+        "INSERT INTO request_events (request_id, status, actor_user_id, created_at) "
+        "SELECT id, status, resolved_by_user_id, COALESCE(resolved_at, updated_at) FROM requests "
+        "WHERE status IS NOT NULL AND status != 'pending'",
+    ]),
+    (5, [
+        "CREATE INDEX IF NOT EXISTS ix_requests_status_region_created ON requests (status, region, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_requests_status_region_district_created "
+        "ON requests (status, region, district, created_at)",
+    ]),
+    (6, [
+        lambda conn: add_column_if_missing(conn, 'outbox', 'next_attempt_at', 'DATETIME'),
+    ]),
+]
+
+
+def add_column_if_missing(conn, table: str, column: str, column_type: str) -> None:
+    # Yangi bazada create_all ustunni allaqachon yaratgan bo'ladi
+    columns = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+
+def run_migrations(engine) -> None:
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE IF NOT EXISTS schema_migrations "
+            "(version INTEGER PRIMARY KEY, applied_at DATETIME DEFAULT CURRENT_TIMESTAMP)"
+        )
+        applied = {row[0] for row in conn.exec_driver_sql("SELECT version FROM schema_migrations")}
+        for version, statements in MIGRATIONS:
+            if version in applied:
+                continue
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.exec_driver_sql(statement)
+            conn.exec_driver_sql("INSERT INTO schema_migrations (version) VALUES (?)", (version,))
+            logging.info(f"Migratsiya {version} qo'llandi")
+
+
 Base.metadata.create_all(engine)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+run_migrations(engine)
+# expire_on_commit=False: commitdan keyin obyekt maydonlarini o'qish event loop'da so'rov yubormaydi
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+# Sinxron SQLAlchemy chaqiruvlari event loop'ni bloklamasligi uchun alohida oqimlar havzasi
+db_executor = ThreadPoolExecutor(max_workers=config.DB_WORKERS, thread_name_prefix="db")
+
+
+# Joriy update davomida bajarilgan SQL so'rovlar soni (DbSessionMiddleware o'rnatadi)
+query_counter: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("query_counter", default=None)
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    counter = query_counter.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+async def run_db(fn, *args, **kwargs):
+    """Sinxron DB funksiyasini DB oqimida bajarib, natijasini kutish"""
+    loop = asyncio.get_running_loop()
+    # Kontekst (query_counter) DB oqimiga ham o'tishi uchun nusxalanadi
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(db_executor, ctx.run, functools.partial(fn, *args, **kwargs))
+
+
+def with_session(fn, *args, **kwargs):
+    """Update'dan tashqaridagi (fon vazifalari) chaqiruvlar uchun alohida sessiya"""
+    db = SessionLocal()
+    try:
+        return fn(db, *args, **kwargs)
+    finally:
+        db.close()
+
+
+def with_write_session(fn, *args, **kwargs):
+    """with_session, lekin fn BEGIN IMMEDIATE tranzaksiyasi ichida bajariladi (fn commit qiladi)"""
+    db = SessionLocal()
+    try:
+        begin_write(db)
+        return fn(db, *args, **kwargs)
+    finally:
+        db.close()
 
 
 # Sostoyaniya
@@ -187,6 +535,138 @@ class SuperAdminAddAdmin(StatesGroup):
     waiting_for_admin_full_name = State()
 
 
+# Xotiradagi kesh (LRU + TTL)
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        # Kesh ham event loop'dan, ham DB oqimlaridan ishlatiladi
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+# Ruxsatlarni tekshirish uchun foydalanuvchi ma'lumotlarining nusxasi
+@dataclass(frozen=True)
+class UserInfo:
+    id: int
+    telegram_id: int
+    role: str
+    region: str
+    district: str
+    institution: str
+    full_name: str
+    position: str
+    created_at: datetime
+
+    @classmethod
+    def from_user(cls, user: 'User') -> 'UserInfo':
+        return cls(
+            id=user.id,
+            telegram_id=user.telegram_id,
+            role=user.role,
+            region=user.region,
+            district=user.district,
+            institution=user.institution,
+            full_name=user.full_name,
+            position=user.position,
+            created_at=user.created_at
+        )
+
+
+user_cache = TTLCache(config.USER_CACHE_SIZE, config.USER_CACHE_TTL)
+# Statistika natijalari barcha adminlar/texniklar uchun umumiy
+stats_cache = TTLCache(1000, config.STATS_CACHE_TTL)
+
+
+# Yangi ariza xabarlarini kimga yuborishni aniqlash uchun xotiradagi indeks:
+# adminlar ro'yxati va (mintaqa, tuman, muassasa) -> texniklar chat id'lari.
+# Foydalanuvchi yaratilganda, o'chirilganda yoki roli o'zgarganda yangilanadi.
+class RoutingIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.admins = {}  # telegram_id -> None (tartibni saqlovchi to'plam)
+        self.technicians = {}  # (region, district, institution) -> {telegram_id: None}
+        self.technician_keys = {}  # telegram_id -> (region, district, institution)
+
+    def load(self, db: Session) -> None:
+        rows = db.query(
+            User.telegram_id, User.role, User.region, User.district, User.institution
+        ).filter(User.role.in_(['admin', 'technician'])).order_by(User.id).all()
+        with self._lock:
+            self.admins, self.technicians, self.technician_keys = {}, {}, {}
+            for telegram_id, role, region, district, institution in rows:
+                self._add(telegram_id, role, (region, district, institution))
+            self.loaded = True
+
+    def _add(self, telegram_id: int, role: str, key: tuple) -> None:
+        if role == 'admin':
+            self.admins[telegram_id] = None
+        elif role == 'technician':
+            self.technicians.setdefault(key, {})[telegram_id] = None
+            self.technician_keys[telegram_id] = key
+
+    def _remove(self, telegram_id: int) -> None:
+        self.admins.pop(telegram_id, None)
+        key = self.technician_keys.pop(telegram_id, None)
+        if key is not None:
+            chat_ids = self.technicians.get(key, {})
+            chat_ids.pop(telegram_id, None)
+            if not chat_ids:
+                self.technicians.pop(key, None)
+
+    def update_user(self, user: 'User') -> None:
+        with self._lock:
+            self._remove(user.telegram_id)
+            self._add(user.telegram_id, user.role, (user.region, user.district, user.institution))
+
+    def remove_user(self, telegram_id: int) -> None:
+        with self._lock:
+            self._remove(telegram_id)
+
+    def admin_chat_ids(self, db: Session) -> List[int]:
+        if not self.loaded:
+            self.load(db)
+        with self._lock:
+            return list(self.admins)
+
+    def technician_chat_ids(self, db: Session, region: str, district: str, institution: str) -> List[int]:
+        if not self.loaded:
+            self.load(db)
+        with self._lock:
+            return list(self.technicians.get((region, district, institution), ()))
+
+
+routing = RoutingIndex()
+
+
 # Vspomogatelnyye funktsii dlya raboty s bazoy dannykh
 def get_db():
     db = SessionLocal()
@@ -200,8 +680,37 @@ def get_user_by_telegram_id(db: Session, telegram_id: int) -> Optional[User]:
     return db.query(User).filter(User.telegram_id == telegram_id).first()
 
 
+async def get_user_info(db: Session, telegram_id: int) -> Optional[UserInfo]:
+    """Foydalanuvchini avval keshdan, topilmasa bazadan olish"""
+    info = user_cache.get(telegram_id)
+    if info is None:
+        user = await run_db(get_user_by_telegram_id, db, telegram_id)
+        if user is None:
+            return None
+        info = UserInfo.from_user(user)
+        user_cache.set(telegram_id, info)
+    return info
+
+
+def invalidate_user(telegram_id: int) -> None:
+    user_cache.pop(telegram_id)
+
+
+def bump_cache_generation(db: Session, name: str) -> None:
+    """Boshqa jarayonlardagi keshni eskirgan deb belgilash (commit chaqiruvchida)"""
+    stmt = sqlite_insert(CacheGeneration).values(name=name, generation=1)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=['name'], set_={'generation': CacheGeneration.generation + 1}
+    ))
+
+
+def get_cache_generations(db: Session) -> dict:
+    return dict(db.query(CacheGeneration.name, CacheGeneration.generation).all())
+
+
 def create_user(db: Session, telegram_id: int, region: str, district: str,
-                institution: str, full_name: str, position: str, role: str = 'user') -> User:
+                institution: str, full_name: str, position: str, role: str = 'user',
+                phone_number: Optional[str] = None) -> User:
     user = User(
         telegram_id=telegram_id,
         region=region,
@@ -209,11 +718,15 @@ def create_user(db: Session, telegram_id: int, region: str, district: str,
         institution=institution,
         full_name=full_name,
         position=position,
-        role=role
+        role=role,
+        phone_number=phone_number
     )
     db.add(user)
+    bump_cache_generation(db, 'users')
     db.commit()
     db.refresh(user)
+    invalidate_user(telegram_id)
+    routing.update_user(user)
     return user
 
 
@@ -235,46 +748,625 @@ def get_institutions_by_district(db: Session, district_name: str) -> List[Instit
     ).all()
 
 
-# Generatory klavish
-def create_regions_keyboard() -> ReplyKeyboardMarkup:
-    db = SessionLocal()
-    regions = get_regions(db)
-    db.close()
+def set_user_role(db: Session, user: User, role: str) -> None:
+    user.role = role
+    bump_cache_generation(db, 'users')
+    db.commit()
+    invalidate_user(user.telegram_id)
+    routing.update_user(user)
+
+
+def get_technicians(db: Session) -> List[User]:
+    return db.query(User).filter(User.role == 'technician').order_by(User.region, User.district).all()
+
+
+def add_outbox_messages(db: Session, messages: List[tuple]) -> None:
+    for chat_id, text in messages:
+        db.add(OutboxMessage(chat_id=chat_id, text=text))
+
+
+def new_request_messages(db: Session, request: Request, submitter_name: str) -> List[tuple]:
+    messages = []
+    for admin_chat_id in routing.admin_chat_ids(db):
+        messages.append((
+            admin_chat_id,
+            f"🔔 Новая заявка #{request.id}\n\n"
+            f"👤 Пользователь: {submitter_name}\n"
+            f"🌍 Регион: {request.region}\n"
+            f"🏘️ Район: {request.district}\n"
+            f"🏢 Учреждение: {request.institution}\n"
+            f"📝 Причина: {request.reason}\n"
+            f"📍 Этаж и комната: {request.floor_room}\n"
+            f"📅 Дата: {request.created_at.strftime('%Y-%m-%d %H:%M')}\n"
+        ))
+    for technician_chat_id in routing.technician_chat_ids(db, request.region, request.district, request.institution):
+        messages.append((
+            technician_chat_id,
+            f"🔔 **Вам поступила новая заявка:**\n\n"
+                 f"🆔 **ID:** #{request.id}\n"
+                 f"🏢 **Учреждение:** {request.institution}\n"
+                 f"📝 **Причина:** {request.reason}\n"
+                 f"📍 **Этаж/Комната:** {request.floor_room}\n"
+                 f"➡️ **Статус:** В ожидании\n\n"
+                 "Для возвращения в главное меню нажмите /start"
+        ))
+    return messages
+
+
+def request_status_messages(db: Session, request: Request, resolved: bool,
+                            technician_name: Optional[str]) -> List[tuple]:
+    messages = []
+    user_who_submitted = db.get(User, request.user_id)
+    if not resolved:
+        if user_who_submitted:
+            messages.append((
+                user_who_submitted.telegram_id,
+                f"🔔 Arizangiz #{request.id} yangilandi:\n\n"
+                f"Status: **{request.status.title()}**.\n\n"
+                f"Sabab: {request.reason}"
+            ))
+        return messages
+
+    if user_who_submitted:
+        messages.append((
+            user_who_submitted.telegram_id,
+            f"🔔 Arizangiz #{request.id} yangilandi:\n\n"
+            f"Status: **{request.status.title()}**.\n"
+            f"PC raqami: {request.pc_number or 'Mavjud emas'}\n"
+            f"Texnik izohi: {request.resolution_details}\n\n"
+            f"Sabab: {request.reason}"
+        ))
+    # Adminlarga ham xabar yuborish
+    for admin_chat_id in routing.admin_chat_ids(db):
+        messages.append((
+            admin_chat_id,
+            f"✅ Ariza bajarildi: #{request.id}\n\n"
+            f"**Kim bajardi:** {technician_name or 'Nomalum'}\n"
+            f"**Status:** {request.status.title()}\n"
+            f"**Uchrezhdeniye:** {request.institution}\n"
+            f"**PC raqami:** {request.pc_number or 'Mavjud emas'}\n"
+            f"**Sabab:** {request.reason}\n"
+            f"**Izoh:** {request.resolution_details}"
+        ))
+    return messages
+
+
+def create_request(db: Session, user_id: int, data: dict, submitter_name: str) -> Request:
+    request = Request(
+        user_id=user_id,
+        region=data['region'],
+        district=data['district'],
+        institution=data['institution'],
+        reason=data['reason'],
+        floor_room=data['floor_room'],
+        submitted_by=data['submitted_by']
+    )
+    db.add(request)
+    db.flush()
+    db.refresh(request)
+    # Bildirishnomalar va kunlik agregat ariza bilan bitta tranzaksiyada yoziladi (commit - write_queue)
+    add_outbox_messages(db, new_request_messages(db, request, submitter_name))
+    db.add(RequestEvent(request_id=request.id, status=request.status, actor_user_id=user_id))
+    bump_daily_stat(db, request, request.status, 1)
+    return request
+
+
+def update_request_status(db: Session, request: Request, status: str, resolved_by_user_id: int,
+                          pc_number: Optional[str] = None, resolution_details: Optional[str] = None,
+                          technician_name: Optional[str] = None) -> Request:
+    previous_status = request.status
+    previous_resolved_at = request.resolved_at
+    request.status = status
+    request.resolved_by_user_id = resolved_by_user_id  # Kim bajarganini yozamiz
+    if pc_number is not None:
+        request.pc_number = pc_number
+    if resolution_details is not None:
+        request.resolution_details = resolution_details
+    # Vaqtlar created_at bilan bir xil manbadan (bazaning func.now()) olinadi
+    if request.first_response_at is None and status != 'pending':
+        request.first_response_at = func.now()
+    request.resolved_at = func.now() if status in RESOLVED_STATUSES else None
+    resolved = resolution_details is not None
+    add_outbox_messages(db, request_status_messages(db, request, resolved, technician_name))
+    db.add(RequestEvent(request_id=request.id, status=status, actor_user_id=resolved_by_user_id))
+
+    # Kunlik agregat: eski statusdan ayirib, yangisiga qo'shiladi
+    bump_daily_stat(db, request, previous_status, -1,
+                    resolved_at=previous_resolved_at if previous_status in RESOLVED_STATUSES else None)
+    db.flush()
+    db.refresh(request, ['updated_at', 'first_response_at', 'resolved_at'])
+    bump_daily_stat(db, request, status, 1, resolved_at=request.resolved_at)
+    return request
+
+
+def set_request_status(db: Session, request_id: int, status: str, resolved_by_user_id: int,
+                       **kwargs) -> Optional[Request]:
+    """write_queue uchun: ariza navbat sessiyasida qayta o'qiladi (joriy status shu tranzaksiyadan)"""
+    request = db.get(Request, request_id)
+    if request is None:
+        return None
+    return update_request_status(db, request, status, resolved_by_user_id, **kwargs)
+
+
+def apply_write_batch(db: Session, operations: List[tuple]) -> List[tuple]:
+    """operations: (funksiya, args, kwargs). Har biri o'z SAVEPOINT'ida - xato faqat o'sha yozuvni
+    bekor qiladi; hammasi bitta commit bilan yoziladi. Natija: (muvaffaqiyat, qiymat yoki xato)"""
+    begin_write(db)
+    results = []
+    for fn, args, kwargs in operations:
+        try:
+            with db.begin_nested():
+                results.append((True, fn(db, *args, **kwargs)))
+        except Exception as e:
+            results.append((False, e))
+    db.commit()
+    return results
+
+
+def bump_daily_stat(db: Session, request: Request, status: str, delta: int,
+                    resolved_at: Optional[datetime] = None) -> None:
+    """Arizaning kunlik agregat qatoriga delta (+1/-1) qo'shadi; resolved_at berilsa hal qilish vaqti ham"""
+    resolved_delta = delta if resolved_at is not None else 0
+    seconds_delta = (resolved_at - request.created_at).total_seconds() * delta if resolved_at is not None else 0.0
+    stmt = sqlite_insert(RequestDailyStat).values(
+        day=request.created_at.date(),
+        region=request.region,
+        district=request.district,
+        institution=request.institution,
+        status=status,
+        requests_count=delta,
+        resolved_count=resolved_delta,
+        resolution_seconds=seconds_delta,
+        updated_at=datetime.now(),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['day', 'region', 'district', 'institution', 'status'],
+        set_={
+            'requests_count': RequestDailyStat.requests_count + stmt.excluded.requests_count,
+            'resolved_count': RequestDailyStat.resolved_count + stmt.excluded.resolved_count,
+            'resolution_seconds': RequestDailyStat.resolution_seconds + stmt.excluded.resolution_seconds,
+            'updated_at': stmt.excluded.updated_at,
+        }
+    )
+    db.execute(stmt)
 
-    buttons = []
-    for region in regions:
-        buttons.append([KeyboardButton(text=region.name)])
-    buttons.append([KeyboardButton(text="Отмена")])
 
-    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+def fetch_pending_outbox(db: Session, limit: int, exclude_ids: List[int]) -> List[OutboxMessage]:
+    query = db.query(OutboxMessage).filter(
+        OutboxMessage.status == 'pending',
+        or_(OutboxMessage.next_attempt_at.is_(None), OutboxMessage.next_attempt_at <= datetime.now())
+    )
+    if exclude_ids:
+        query = query.filter(OutboxMessage.id.notin_(exclude_ids))
+    return query.order_by(OutboxMessage.id).limit(limit).all()
+
+
+def outbox_retry_delay(attempts: int, base_seconds: float, max_seconds: float) -> float:
+    """attempts-urinish muvaffaqiyatsiz bo'lgandan keyingi kutish (soniya): base, 2*base, 4*base, ..."""
+    return min(base_seconds * 2 ** (attempts - 1), max_seconds)
+
+
+def mark_outbox_results(db: Session, results: List[tuple], max_attempts: int,
+                        retry_base_seconds: float, retry_max_seconds: float) -> None:
+    """results: (outbox id, natija) juftliklari; natija True/False yoki None (chat bloklangan)"""
+    now = datetime.now()
+    for message_id, delivered in results:
+        message = db.get(OutboxMessage, message_id)
+        if message is None:
+            continue
+        message.attempts = (message.attempts or 0) + 1
+        if delivered:
+            message.status = 'sent'
+            message.sent_at = now
+        elif delivered is None:
+            message.status = 'skipped'
+        elif message.attempts >= max_attempts:
+            message.status = 'failed'
+        else:
+            delay = outbox_retry_delay(message.attempts, retry_base_seconds, retry_max_seconds)
+            message.next_attempt_at = now + timedelta(seconds=delay)
+    db.commit()
 
 
-def create_districts_keyboard(region_name: str) -> ReplyKeyboardMarkup:
-    db = SessionLocal()
-    districts = get_districts_by_region(db, region_name)
-    db.close()
+def get_outbox_counts(db: Session) -> dict:
+    return dict(db.query(OutboxMessage.status, func.count(OutboxMessage.id)).group_by(OutboxMessage.status).all())
 
-    buttons = []
-    for district in districts:
-        buttons.append([KeyboardButton(text=district.name)])
-    buttons.append([KeyboardButton(text="Отмена")])
 
-    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+def purge_sent_outbox(db: Session, older_than: datetime) -> int:
+    count = db.query(OutboxMessage).filter(
+        OutboxMessage.status == 'sent',
+        OutboxMessage.sent_at < older_than
+    ).delete(synchronize_session=False)
+    db.commit()
+    return count
 
 
-def create_institutions_keyboard(district_name: str) -> ReplyKeyboardMarkup:
-    db = SessionLocal()
-    institutions = get_institutions_by_district(db, district_name)
-    db.close()
+def get_blocked_chats(db: Session) -> dict:
+    return dict(db.query(BlockedChat.chat_id, BlockedChat.blocked_at).all())
+
+
+def save_blocked_chat(db: Session, chat_id: int, reason: str, blocked_at: datetime) -> None:
+    db.merge(BlockedChat(chat_id=chat_id, reason=reason[:200], blocked_at=blocked_at))
+    bump_cache_generation(db, 'blocked_chats')
+    db.commit()
+
+
+def delete_blocked_chat(db: Session, chat_id: int) -> None:
+    db.query(BlockedChat).filter(BlockedChat.chat_id == chat_id).delete(synchronize_session=False)
+    bump_cache_generation(db, 'blocked_chats')
+    db.commit()
+
 
+def get_report_file_id(db: Session, filename: str) -> Optional[str]:
+    row = db.query(ReportFile.file_id).filter(ReportFile.filename == filename).first()
+    return row[0] if row else None
+
+
+def save_report_file_id(db: Session, filename: str, file_id: str) -> None:
+    db.merge(ReportFile(filename=filename, file_id=file_id, created_at=datetime.now()))
+    db.commit()
+
+
+def delete_report_file_id(db: Session, filename: str) -> None:
+    db.query(ReportFile).filter(ReportFile.filename == filename).delete(synchronize_session=False)
+    db.commit()
+
+
+def purge_report_files(db: Session, older_than: datetime) -> int:
+    count = db.query(ReportFile).filter(ReportFile.created_at < older_than).delete(synchronize_session=False)
+    db.commit()
+    return count
+
+
+def load_fsm_record(db: Session, key: str) -> Optional[tuple]:
+    row = db.query(FsmRecord.state, FsmRecord.data).filter(FsmRecord.key == key).first()
+    return (row.state, json.loads(row.data)) if row else None
+
+
+def save_fsm_records(db: Session, records: List[tuple]) -> None:
+    """records: (key, state, data, updated_at); bo'sh holatlar o'chiriladi, qolganlari upsert qilinadi"""
+    empty = [key for key, state, data, _ in records if state is None and not data]
+    if empty:
+        db.query(FsmRecord).filter(FsmRecord.key.in_(empty)).delete(synchronize_session=False)
+    rows = [
+        {'key': key, 'state': state, 'data': json.dumps(data, ensure_ascii=False), 'updated_at': updated_at}
+        for key, state, data, updated_at in records if state is not None or data
+    ]
+    if rows:
+        stmt = sqlite_insert(FsmRecord).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['key'],
+            set_={'state': stmt.excluded.state, 'data': stmt.excluded.data, 'updated_at': stmt.excluded.updated_at}
+        )
+        db.execute(stmt)
+    db.commit()
+
+
+def claim_update(db: Session, update_id: int) -> bool:
+    """update_id birinchi marta ko'rilayotgan bo'lsa True (boshqa jarayon olgan bo'lsa False)"""
+    stmt = sqlite_insert(ProcessedUpdate).values(update_id=update_id, created_at=datetime.now())
+    claimed = db.execute(stmt.on_conflict_do_nothing(index_elements=['update_id'])).rowcount == 1
+    db.commit()
+    return claimed
+
+
+def purge_processed_updates(db: Session, older_than: datetime) -> int:
+    count = db.query(ProcessedUpdate).filter(ProcessedUpdate.created_at < older_than).delete(synchronize_session=False)
+    db.commit()
+    return count
+
+
+def purge_fsm_records(db: Session, older_than: datetime) -> int:
+    count = db.query(FsmRecord).filter(FsmRecord.updated_at < older_than).delete(synchronize_session=False)
+    db.commit()
+    return count
+
+
+def requeue_failed_outbox(db: Session) -> int:
+    count = db.query(OutboxMessage).filter(OutboxMessage.status == 'failed').update(
+        {OutboxMessage.status: 'pending', OutboxMessage.attempts: 0, OutboxMessage.next_attempt_at: None},
+        synchronize_session=False
+    )
+    db.commit()
+    return count
+
+
+def get_active_requests_page_query(db: Session, status: str, limit: int = 10,
+                                   institution: Optional[str] = None, region: Optional[str] = None,
+                                   district: Optional[str] = None, cursor: Optional[tuple] = None,
+                                   newer: bool = False):
+    """Bitta status uchun keyset so'rovi: (status, created_at) indeksi tartibni beradi, saralash kerak emas"""
+    # created_at satr sifatida solishtiriladi: bazadagi qiymat formatlari aralash bo'lishi mumkin
+    created_key = type_coerce(Request.created_at, String)
+    query = db.query(Request, created_key).filter(Request.status == status)
+    if institution is not None:
+        query = query.filter(Request.institution == institution)
+    if region is not None:
+        query = query.filter(Request.region == region)
+    if district is not None:
+        query = query.filter(Request.district == district)
+
+    key = tuple_(created_key, Request.id)
+    if newer:
+        if cursor is not None:
+            query = query.filter(key > tuple_(*cursor))
+        return query.order_by(Request.created_at, Request.id).limit(limit + 1)
+    if cursor is not None:
+        query = query.filter(key < tuple_(*cursor))
+    return query.order_by(Request.created_at.desc(), Request.id.desc()).limit(limit + 1)
+
+
+def get_active_requests_page(db: Session, limit: int, status: Optional[str] = None,
+                             newer: bool = False, **filters) -> tuple:
+    """Faol arizalarning bitta sahifasi, (created_at, id) bo'yicha keyset sahifalash.
+
+    filters: institution, region, district va cursor - chegaradagi arizaning
+    (created_at bazadagi satr ko'rinishida, id) juftligi. newer=False bo'lsa cursor'dan
+    eskiroqlar, True bo'lsa yangiroqlar olinadi.
+    Qaytaradi: (eng yangisidan eskisiga tartiblangan [(Request, created_at satri)], shu yo'nalishda yana bormi).
+    """
+    # "IN (pending, in_progress)" indeksdan tartiblangan holda o'qilmaydi va barcha faol arizalar
+    # saralanadi; shuning uchun har bir status alohida (limit + 1 tadan) o'qiladi va birlashtiriladi
+    rows = []
+    for item in ((status,) if status else ACTIVE_STATUSES):
+        rows.extend(get_active_requests_page_query(db, item, limit, newer=newer, **filters).all())
+    rows.sort(key=lambda row: (row[1], row[0].id), reverse=not newer)
+    page = rows[:limit]
+    if newer:
+        page.reverse()
+    return page, len(rows) > limit
+
+
+def get_user_requests(db: Session, user_id: int, limit: int = 10) -> List[Request]:
+    return db.query(Request).filter(Request.user_id == user_id).order_by(Request.created_at.desc()).limit(limit).all()
+
+
+def get_institution_stats(db: Session, institution: str) -> tuple:
+    # Bitta so'rov: (institution, status, ...) indeksi bo'yicha shartli yig'indilar
+    total, completed, in_progress = db.query(
+        func.count(Request.id),
+        func.sum(case((Request.status == 'completed', 1), else_=0)),
+        func.sum(case((Request.status == 'in_progress', 1), else_=0)),
+    ).filter(Request.institution == institution).one()
+    return total, completed or 0, in_progress or 0
+
+
+def get_system_stats(db: Session) -> dict:
+    # Bitta so'rov: foydalanuvchilar rol, arizalar status bo'yicha guruhlanadi (UNION ALL)
+    rows = db.execute(union_all(
+        db.query(literal('role'), User.role, func.count(User.id)).group_by(User.role).statement,
+        db.query(literal('status'), Request.status, func.count(Request.id)).group_by(Request.status).statement,
+    )).all()
+    roles = {key: count for kind, key, count in rows if kind == 'role'}
+    statuses = {key: count for kind, key, count in rows if kind == 'status'}
+    return {
+        'users': roles.get('user', 0),
+        'technicians': roles.get('technician', 0),
+        'active_requests': statuses.get('pending', 0) + statuses.get('in_progress', 0),
+        'completed_requests': statuses.get('completed', 0),
+        'all_requests': sum(statuses.values()),
+    }
+
+
+async def get_cached_stats(key, fn, db: Session, *args):
+    """Statistikani STATS_CACHE_TTL davomida keshdan berish (tez-tez bosiladigan ekranlar uchun)"""
+    stats = stats_cache.get(key)
+    if stats is None:
+        stats = await run_db(fn, db, *args)
+        stats_cache.set(key, stats)
+    return stats
+
+
+def iter_report_rows(db: Session, start: datetime, end: datetime, chunk_size: int):
+    """Hisobot jadvali uchun qatorlar: foydalanuvchi ismi JOIN orqali olinadi, natija bo'laklab o'qiladi"""
+    return db.query(
+        Request.id, User.full_name, Request.region, Request.district, Request.institution,
+        Request.reason, Request.pc_number, Request.status, Request.created_at, Request.resolution_details
+    ).outerjoin(User, Request.user_id == User.id).filter(
+        Request.created_at >= start,
+        Request.created_at <= end
+    ).order_by(Request.created_at, Request.id).yield_per(chunk_size)
+
+
+def get_report_watermark(db: Session, start: datetime, end: datetime) -> tuple:
+    """Davr ichidagi arizalar versiyasi: soni va oxirgi o'zgarish vaqti (kunlik agregatlardan),
+    hamda davr ichidagi oxirgi status o'zgarishi - davrdan oldin yaratilib, davr ichida yakunlangan
+    arizalar texniklar jadvalini o'zgartiradi"""
+    count, updated_at = db.query(func.sum(RequestDailyStat.requests_count), func.max(RequestDailyStat.updated_at)).filter(
+        RequestDailyStat.day >= start.date(),
+        RequestDailyStat.day <= end.date()
+    ).one()
+    last_event_id = db.query(func.max(RequestEvent.id)).filter(
+        RequestEvent.created_at >= start,
+        RequestEvent.created_at <= end
+    ).scalar()
+    return count, updated_at, last_event_id
+
+
+def get_report_status_counts(db: Session, start: datetime, end: datetime) -> dict:
+    rows = db.query(RequestDailyStat.status, func.sum(RequestDailyStat.requests_count)).filter(
+        RequestDailyStat.day >= start.date(),
+        RequestDailyStat.day <= end.date()
+    ).group_by(RequestDailyStat.status).all()
+    return {status: count for status, count in rows if count}
+
+
+def get_resolution_counts(db: Session, start: datetime, end: datetime) -> dict:
+    """Davr ichida har bir texnik yakunlagan arizalar soni (status tarixidan, indeks bo'yicha)"""
+    rows = db.query(User.full_name, func.count(RequestEvent.id)).join(
+        User, RequestEvent.actor_user_id == User.id
+    ).filter(
+        RequestEvent.status.in_(RESOLVED_STATUSES),
+        RequestEvent.created_at >= start,
+        RequestEvent.created_at <= end
+    ).group_by(User.full_name).all()
+    return dict(rows)
+
+
+def get_report_region_summary(db: Session, start: datetime, end: datetime) -> List[tuple]:
+    """Hududlar bo'yicha: jami, bajarilgan, hal qilinganlar soni va hal qilish vaqti yig'indisi"""
+    return db.query(
+        RequestDailyStat.region,
+        func.sum(RequestDailyStat.requests_count),
+        func.sum(case((RequestDailyStat.status == 'completed', RequestDailyStat.requests_count), else_=0)),
+        func.sum(RequestDailyStat.resolved_count),
+        func.sum(RequestDailyStat.resolution_seconds),
+    ).filter(
+        RequestDailyStat.day >= start.date(),
+        RequestDailyStat.day <= end.date()
+    ).group_by(RequestDailyStat.region).order_by(RequestDailyStat.region).all()
+
+
+def delete_object(db: Session, model, object_id: int):
+    """O'chirish commit qilinmaydi: chaqiruvchi kesh versiyasini shu tranzaksiyada oshirib, commit qiladi"""
+    obj = db.query(model).get(object_id)
+    if obj:
+        db.delete(obj)
+        db.flush()
+    return obj
+
+
+def delete_user(db: Session, user_id: int) -> Optional[User]:
+    user = delete_object(db, User, user_id)
+    if user:
+        bump_cache_generation(db, 'users')
+        db.commit()
+        invalidate_user(user.telegram_id)
+        routing.remove_user(user.telegram_id)
+    return user
+
+
+def add_institution(db: Session, name: str, district_id: int) -> Institution:
+    institution = Institution(name=name, district_id=district_id)
+    db.add(institution)
+    bump_cache_generation(db, 'geography')
+    db.commit()
+    geography.load(db)
+    return institution
+
+
+def remove_institution(db: Session, institution_id: int) -> Optional[Institution]:
+    institution = delete_object(db, Institution, institution_id)
+    if institution:
+        bump_cache_generation(db, 'geography')
+        db.commit()
+        geography.load(db)
+    return institution
+
+
+def get_institutions_with_districts(db: Session) -> List[tuple]:
+    return db.query(Institution, District.name).join(District).all()
+
+
+def explain_query_plans(db: Session) -> Dict[str, List[str]]:
+    """Asosiy so'rovlarning SQLite rejasi (EXPLAIN QUERY PLAN qatorlari); tests/test_query_plans.py tekshiradi"""
+    week_start = datetime.now() - timedelta(days=7)
+    queries = {
+        'texnik arizalari': get_active_requests_page_query(db, 'pending', institution='', cursor=('', 0)),
+        'muassasa statistikasi': db.query(Request.id).filter(
+            Request.institution == '', Request.status == 'completed'
+        ),
+        'faol arizalar': get_active_requests_page_query(db, 'pending', cursor=('', 0)),
+        'faol arizalar (mintaqa)': get_active_requests_page_query(db, 'pending', region='', cursor=('', 0)),
+        'faol arizalar (tuman)': get_active_requests_page_query(db, 'pending', region='', district='', cursor=('', 0)),
+        'foydalanuvchi arizalari': db.query(Request).filter(
+            Request.user_id == 0
+        ).order_by(Request.created_at.desc()).limit(10),
+        'haftalik hisobot': db.query(Request).filter(
+            Request.created_at >= week_start, Request.created_at <= datetime.now()
+        ),
+        'tuman nomi': db.query(District).filter(District.name == ''),
+        'muassasa nomi': db.query(Institution).filter(Institution.name == ''),
+    }
+
+    plans = {}
+    for name, query in queries.items():
+        sql = str(query.statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+        plans[name] = [row[-1] for row in db.execute(text("EXPLAIN QUERY PLAN " + sql))]
+    return plans
+
+
+# Mintaqa -> tuman -> muassasa daraxti (xotirada) va tayyor klaviaturalar.
+# Faqat admin muassasa qo'shganda/o'chirganda qayta yuklanadi.
+class GeographyIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.regions_keyboard = build_choice_keyboard([])
+        self.district_keyboards = {}  # mintaqa nomi -> klaviatura
+        self.institution_keyboards = {}  # tuman nomi -> klaviatura
+        self.region_ids = {}  # mintaqa nomi -> id
+        self.district_ids = {}  # (mintaqa id, tuman nomi) -> id
+        self.region_names = {}  # id -> mintaqa nomi
+        self.district_names = {}  # id -> tuman nomi
+        self.region_districts = {}  # mintaqa id -> [(tuman id, tuman nomi)]
+        self.institutions = set()  # (tuman nomi, muassasa nomi)
+
+    def load(self, db: Session) -> None:
+        regions = db.query(Region).order_by(Region.id).all()
+        districts = db.query(District, Region.name).join(Region).order_by(District.id).all()
+        institutions = db.query(Institution, District.name).join(District).order_by(Institution.id).all()
+
+        districts_by_region = {}
+        for district, region_name in districts:
+            if district.is_active:
+                districts_by_region.setdefault(region_name, []).append(district.name)
+
+        institutions_by_district = {}
+        for institution, district_name in institutions:
+            if institution.is_active:
+                institutions_by_district.setdefault(district_name, []).append(institution.name)
+
+        with self._lock:
+            self.regions_keyboard = build_choice_keyboard([r.name for r in regions if r.is_active])
+            self.district_keyboards = {name: build_choice_keyboard(items) for name, items in districts_by_region.items()}
+            self.institution_keyboards = {name: build_choice_keyboard(items) for name, items in institutions_by_district.items()}
+            self.region_ids = {r.name: r.id for r in regions}
+            self.district_ids = {(d.region_id, d.name): d.id for d, _ in districts}
+            self.region_names = {r.id: r.name for r in regions}
+            self.district_names = {d.id: d.name for d, _ in districts}
+            self.region_districts = {}
+            for d, _ in districts:
+                self.region_districts.setdefault(d.region_id, []).append((d.id, d.name))
+            self.institutions = {(district_name, i.name) for i, district_name in institutions}
+            self.loaded = True
+
+    def reload(self) -> None:
+        with_session(self.load)
+
+    def ensure_loaded(self) -> None:
+        if not self.loaded:
+            self.reload()
+
+
+def build_choice_keyboard(names: List[str]) -> ReplyKeyboardMarkup:
     buttons = []
-    for institution in institutions:
-        buttons.append([KeyboardButton(text=institution.name)])
+    for name in names:
+        buttons.append([KeyboardButton(text=name)])
     buttons.append([KeyboardButton(text="Отмена")])
 
     return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
 
 
+geography = GeographyIndex()
+
+
+# Generatory klavish
+def create_regions_keyboard() -> ReplyKeyboardMarkup:
+    geography.ensure_loaded()
+    return geography.regions_keyboard
+
+
+def create_districts_keyboard(region_name: str) -> ReplyKeyboardMarkup:
+    geography.ensure_loaded()
+    return geography.district_keyboards.get(region_name) or build_choice_keyboard([])
+
+
+def create_institutions_keyboard(district_name: str) -> ReplyKeyboardMarkup:
+    geography.ensure_loaded()
+    return geography.institution_keyboards.get(district_name) or build_choice_keyboard([])
+
+
 def create_main_user_keyboard() -> ReplyKeyboardMarkup:
     buttons = [
         [KeyboardButton(text="📝 Отправить заявку")],
@@ -313,6 +1405,27 @@ def create_request_status_keyboard(request_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+def create_technician_requests_keyboard(rows: List[tuple], has_older: bool, has_newer: bool) -> InlineKeyboardMarkup:
+    # Har bir ariza uchun bitta qator: create_request_status_keyboard'dagi amallar
+    buttons = []
+    for req, _ in rows:
+        buttons.append([
+            InlineKeyboardButton(text=f"✅ #{req.id}", callback_data=f"status_completed_{req.id}"),
+            InlineKeyboardButton(text=f"🔄 #{req.id}", callback_data=f"status_in_progress_{req.id}"),
+            InlineKeyboardButton(text=f"❌ #{req.id}", callback_data=f"status_not_completed_{req.id}"),
+        ])
+    navigation = []
+    if has_newer and rows:
+        navigation.append(InlineKeyboardButton(
+            text="⬅️ Назад", callback_data=f"treq:n:{encode_request_cursor(rows[0][1], rows[0][0].id)}"))
+    if has_older and rows:
+        navigation.append(InlineKeyboardButton(
+            text="Вперёд ➡️", callback_data=f"treq:o:{encode_request_cursor(rows[-1][1], rows[-1][0].id)}"))
+    if navigation:
+        buttons.append(navigation)
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
 def create_confirmation_keyboard() -> InlineKeyboardMarkup:
     buttons = [
         [InlineKeyboardButton(text="✅ Да", callback_data="confirm_yes")],
@@ -359,6 +1472,189 @@ def create_delete_institution_keyboard(institutions: List[tuple]) -> InlineKeybo
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+# Admin faol arizalar ro'yxati. callback_data: areq:<status>:<mintaqa id>:<tuman id>:<yo'nalish>:<cursor>
+# status: a - barcha faollar, p - pending, i - in_progress; id 0 - filtr yo'q;
+# yo'nalish: f - birinchi sahifa, o - cursor'dan eskiroqlar, n - yangiroqlar.
+ADMIN_STATUS_FILTERS = {'a': None, 'p': 'pending', 'i': 'in_progress'}
+ADMIN_STATUS_LABELS = {'a': "Все активные", 'p': "⏳ Ожидают", 'i': "🔄 В процессе"}
+
+
+def encode_request_cursor(created_at: str, request_id: int) -> str:
+    # '2026-10-17 23:19:51.123456' -> '20261017231951123456-42' (callback_data 64 baytdan oshmasligi uchun)
+    return f"{''.join(ch for ch in created_at if ch.isdigit())}-{request_id}"
+
+
+def decode_request_cursor(value: str) -> tuple:
+    digits, request_id = value.split('-')
+    created_at = f"{digits[0:4]}-{digits[4:6]}-{digits[6:8]} {digits[8:10]}:{digits[10:12]}:{digits[12:14]}"
+    if len(digits) > 14:
+        created_at += f".{digits[14:]}"
+    return created_at, int(request_id)
+
+
+def create_admin_requests_keyboard(status: str, region_id: int, district_id: int, rows: List[tuple],
+                                   has_older: bool, has_newer: bool) -> InlineKeyboardMarkup:
+    filters = f"{status}:{region_id}:{district_id}"
+    buttons = []
+    navigation = []
+    if has_newer and rows:
+        navigation.append(InlineKeyboardButton(
+            text="⬅️ Назад", callback_data=f"areq:{filters}:n:{encode_request_cursor(rows[0][1], rows[0][0].id)}"))
+    if has_older and rows:
+        navigation.append(InlineKeyboardButton(
+            text="Вперёд ➡️", callback_data=f"areq:{filters}:o:{encode_request_cursor(rows[-1][1], rows[-1][0].id)}"))
+    if navigation:
+        buttons.append(navigation)
+
+    next_status = {'a': 'p', 'p': 'i', 'i': 'a'}[status]
+    buttons.append([
+        InlineKeyboardButton(text=f"Статус: {ADMIN_STATUS_LABELS[status]}",
+                             callback_data=f"areq:{next_status}:{region_id}:{district_id}:f:"),
+    ])
+    region_row = [InlineKeyboardButton(text="🌍 Регион", callback_data=f"areqf:r:{filters}")]
+    if region_id:
+        region_row.append(InlineKeyboardButton(text="🏙 Район", callback_data=f"areqf:d:{filters}"))
+    if region_id or district_id or status != 'a':
+        region_row.append(InlineKeyboardButton(text="✖️ Сбросить", callback_data="areq:a:0:0:f:"))
+    buttons.append(region_row)
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def create_admin_requests_filter_keyboard(kind: str, status: str, region_id: int,
+                                          district_id: int) -> InlineKeyboardMarkup:
+    buttons = []
+    if kind == 'r':
+        buttons.append([InlineKeyboardButton(text="Все регионы", callback_data=f"areq:{status}:0:0:f:")])
+        for rid, name in sorted(geography.region_names.items(), key=lambda item: item[1]):
+            buttons.append([InlineKeyboardButton(text=name, callback_data=f"areq:{status}:{rid}:0:f:")])
+    else:
+        buttons.append([InlineKeyboardButton(text="Все районы", callback_data=f"areq:{status}:{region_id}:0:f:")])
+        for did, name in geography.region_districts.get(region_id, []):
+            buttons.append([InlineKeyboardButton(text=name, callback_data=f"areq:{status}:{region_id}:{did}:f:")])
+    buttons.append([InlineKeyboardButton(text="⬅️ Назад", callback_data=f"areq:{status}:{region_id}:{district_id}:f:")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+# Tahlil: davrdagi arizalar bitta so'rov bilan pandas ustunlariga yuklanadi va vektorli hisoblanadi.
+# Xom vaqt qatorlari DB-API kursoridan olinadi (ORM/Row qatlamisiz), davomiyliklar (soatda)
+# NumPy'da datetime64 ustida hisoblanadi.
+ANALYTICS_COLUMNS = ['district', 'institution', 'resolved_by_user_id',
+                     'response_hours', 'resolution_hours', 'age_hours']
+
+
+def hours_since(later: np.ndarray, earlier: np.ndarray) -> np.ndarray:
+    return (later - earlier) / np.timedelta64(1, 'h')
+
+
+def load_request_frame(db: Session, start: datetime, end: datetime) -> pd.DataFrame:
+    stmt = select(
+        Request.district, Request.institution, Request.resolved_by_user_id,
+        Request.created_at, Request.first_response_at, Request.resolved_at
+    ).where(
+        Request.created_at >= start,
+        Request.created_at <= end
+    )
+    conn = db.connection()
+    compiled = stmt.compile(dialect=conn.dialect)
+    # Chegaralar ORM yozgan formatda bog'lanadi, aks holda satrlar bo'yicha solishtirish siljiydi
+    to_db = Request.created_at.type.dialect_impl(conn.dialect).bind_processor(conn.dialect)
+    raw = pd.read_sql(str(compiled), conn.connection.driver_connection,
+                      params=[to_db(compiled.params[name]) for name in compiled.positiontup])
+
+    # func.now() (CURRENT_TIMESTAMP) UTC yozadi; np.datetime64('now') ham UTC
+    created, responded, resolved = (
+        pd.to_datetime(raw[column], format='ISO8601').to_numpy(dtype='datetime64[us]')
+        for column in ('created_at', 'first_response_at', 'resolved_at')
+    )
+    frame = pd.DataFrame({
+        'district': raw['district'],
+        'institution': raw['institution'],
+        'resolved_by_user_id': raw['resolved_by_user_id'],
+        'response_hours': hours_since(responded, created),
+        'resolution_hours': hours_since(resolved, created),
+        'age_hours': hours_since(np.datetime64('now', 'us'), created),
+    }, columns=ANALYTICS_COLUMNS)
+
+    # Texnik ismlari alohida kichik so'rov bilan olinadi (har bir qatorga JOIN qilinmaydi)
+    resolver_ids = [int(user_id) for user_id in frame['resolved_by_user_id'].dropna().unique()]
+    names = dict(db.query(User.id, User.full_name).filter(User.id.in_(resolver_ids)).all()) if resolver_ids else {}
+    frame['technician'] = frame['resolved_by_user_id'].map(names)
+    return frame
+
+
+def summarize_requests(frame: pd.DataFrame, key: str) -> pd.DataFrame:
+    grouped = frame.groupby(key)
+    return pd.DataFrame({
+        'requests': grouped.size(),
+        'response_p50': grouped['response_hours'].median(),
+        'resolution_p50': grouped['resolution_hours'].median(),
+        'resolution_p90': grouped['resolution_hours'].quantile(0.9),
+        'sla_breach_rate': grouped['sla_breach'].mean(),
+    }).sort_values('sla_breach_rate', ascending=False)
+
+
+def compute_request_analytics(frame: pd.DataFrame, start: datetime, end: datetime,
+                              sla_response_hours: float, sla_resolution_hours: float,
+                              resolution_counts: Optional[dict] = None) -> dict:
+    """Javob/hal qilish persentillari, SLA buzilishlari va texniklar unumdorligi.
+
+    resolution_counts berilsa, texniklar unumdorligi davrda yaratilgan arizalar emas,
+    davrda yakunlangan arizalar (status tarixidan) bo'yicha hisoblanadi.
+    """
+    response_hours = frame['response_hours']
+    resolution_hours = frame['resolution_hours']
+    age_hours = frame['age_hours']
+    # Hali javob berilmagan / hal qilinmagan arizalar muddati o'tgan bo'lsa buzilish hisoblanadi
+    response_breach = np.where(response_hours.notna(), response_hours > sla_response_hours, age_hours > sla_response_hours)
+    resolution_breach = np.where(resolution_hours.notna(), resolution_hours > sla_resolution_hours,
+                                 age_hours > sla_resolution_hours)
+    frame = frame.assign(sla_breach=resolution_breach)
+
+    resolved = frame[resolution_hours.notna() & frame['technician'].notna()]
+    days = max((end - start).total_seconds() / 86400, 1.0)
+    grouped = resolved.groupby('technician')
+    resolved_counts = grouped.size() if resolution_counts is None else pd.Series(resolution_counts, dtype='int64')
+    technicians = pd.DataFrame({
+        'resolved': resolved_counts,
+        'resolution_p50': grouped['resolution_hours'].median(),
+        'sla_breach_rate': grouped['sla_breach'].mean(),
+    })
+    technicians['resolved'] = technicians['resolved'].fillna(0).astype('int64')
+    technicians['per_day'] = technicians['resolved'] / days
+    technicians = technicians[['resolved', 'per_day', 'resolution_p50', 'sla_breach_rate']].sort_values(
+        'resolved', ascending=False)
+
+    total = len(frame)
+    return {
+        'overall': {
+            'requests': total,
+            'response_p50': response_hours.median(),
+            'response_p90': response_hours.quantile(0.9),
+            'resolution_p50': resolution_hours.median(),
+            'resolution_p90': resolution_hours.quantile(0.9),
+            'response_breach_rate': response_breach.mean() if total else float('nan'),
+            'resolution_breach_rate': resolution_breach.mean() if total else float('nan'),
+        },
+        'districts': summarize_requests(frame, 'district'),
+        'institutions': summarize_requests(frame, 'institution'),
+        'technicians': technicians,
+    }
+
+
+def get_request_analytics(db: Session, start: datetime, end: datetime) -> dict:
+    frame = load_request_frame(db, start, end)
+    return compute_request_analytics(frame, start, end, config.SLA_RESPONSE_HOURS, config.SLA_RESOLUTION_HOURS,
+                                     resolution_counts=get_resolution_counts(db, start, end))
+
+
+def format_hours(value) -> str:
+    return 'N/A' if pd.isna(value) else f'{value:.1f}'
+
+
+def format_rate(value) -> str:
+    return 'N/A' if pd.isna(value) else f'{value * 100:.1f}%'
+
+
 # Generator otchetov v formate PDF
 class PDFReportGenerator:
     def __init__(self, db: Session):
@@ -367,10 +1663,11 @@ class PDFReportGenerator:
         self.styles.add(ParagraphStyle(name='TableText', fontSize=7, leading=9))
         self.styles.add(ParagraphStyle(name='TableBold', fontSize=8, leading=10, fontName='Helvetica-Bold'))
 
-    def generate_weekly_report(self, start_date: datetime, end_date: datetime) -> str:
-        """Generatsiya yezhenedelnogo PDF-otcheta"""
-        filename = f"weekly_report_{start_date.strftime('%Y%m%d')}_to_{end_date.strftime('%Y%m%d')}.pdf"
-        filepath = os.path.join(config.REPORTS_DIR, filename)
+    def generate_report(self, start_date: datetime, end_date: datetime, filepath: Optional[str] = None) -> str:
+        """Generatsiya PDF-otcheta za period (start_date..end_date vklyuchitelno)"""
+        if filepath is None:
+            filename = f"report_{start_date.strftime('%Y%m%d')}_to_{end_date.strftime('%Y%m%d')}.pdf"
+            filepath = os.path.join(config.REPORTS_DIR, filename)
 
         doc = SimpleDocTemplate(filepath, pagesize=A4, leftMargin=30, rightMargin=30, topMargin=30, bottomMargin=30)
         story = []
@@ -387,16 +1684,14 @@ class PDFReportGenerator:
                       title_style))
         story.append(Spacer(1, 20))
 
-        requests = self.db.query(Request).filter(
-            Request.created_at >= start_date,
-            Request.created_at <= end_date + timedelta(days=1, seconds=-1)
-        ).all()
+        period_end = end_date + timedelta(days=1, seconds=-1)
+        status_counts = get_report_status_counts(self.db, start_date, period_end)
 
-        total_requests = len(requests)
-        completed_requests = sum(1 for r in requests if r.status == 'completed')
-        in_progress_requests = sum(1 for r in requests if r.status == 'in_progress')
-        pending_requests = sum(1 for r in requests if r.status == 'pending')
-        not_completed_requests = sum(1 for r in requests if r.status == 'not_completed')
+        total_requests = sum(status_counts.values())
+        completed_requests = status_counts.get('completed', 0)
+        in_progress_requests = status_counts.get('in_progress', 0)
+        pending_requests = status_counts.get('pending', 0)
+        not_completed_requests = status_counts.get('not_completed', 0)
 
         summary_data = [
             ['Status', 'Soni', 'Foyiz'],
@@ -426,76 +1721,800 @@ class PDFReportGenerator:
         story.append(summary_table)
         story.append(Spacer(1, 30))
 
-        if requests:
-            story.append(Paragraph("Zayafkalar royxati", self.styles['Heading2']))
+        region_rows = get_report_region_summary(self.db, start_date, period_end)
+        if region_rows:
+            story.append(Paragraph("Hududlar bo'yicha", self.styles['Heading2']))
             story.append(Spacer(1, 12))
-
-            table_data = [
-                ['ID', 'Foydalanuvchi', 'Region', 'Rayon', 'Tashkilot', 'Sababi', 'PC', 'Status', 'Sozdano', 'Ish bajarildi'] # Yangi ustun 'PC' va 'Ish bajarildi'
-            ]
-
-            for req in requests:
-                reason_text = req.reason
-                if len(reason_text) > 50: # Cheklovni 50 belgiga tushirdik
-                    reason_text = reason_text[:50] + '...'
-
-                resolution_text = req.resolution_details or "N/A" # Yangi
-                if len(resolution_text) > 50:
-                    resolution_text = resolution_text[:50] + '...'
-
-                row = [
-                    Paragraph(str(req.id), self.styles['TableText']),
-                    Paragraph(req.user.full_name, self.styles['TableText']),
-                    Paragraph(req.region, self.styles['TableText']),
-                    Paragraph(req.district, self.styles['TableText']),
-                    Paragraph(req.institution, self.styles['TableText']),
-                    Paragraph(reason_text, self.styles['TableText']),
-                    Paragraph(req.pc_number or 'N/A', self.styles['TableText']), # PC raqami
-                    Paragraph(req.status.title(), self.styles['TableText']),
-                    Paragraph(req.created_at.strftime('%Y-%m-%d %H:%M'), self.styles['TableText']),
-                    Paragraph(resolution_text, self.styles['TableText']), # Ish bajarildi izohi
-                ]
-                table_data.append(row)
-
-            # Ustunlarning aniq kengliklari (umumiy 540 punkt)
-            col_widths = [
-                20,  # ID
-                60,  # Polzovatel
-                60,  # Region
-                60,  # Rayon
-                80,  # Uchrezhdeniye
-                70,  # Prichina (qisqartirilgan)
-                30,  # PC
-                40,  # Status
-                70,  # Sozdano
-                50 # Ish bajarildi
-            ]
-
-            detailed_table = Table(table_data, colWidths=col_widths)
-            detailed_table.setStyle(TableStyle([
+            region_data = [['Region', 'Zayafkalar', 'Bajarilgan', "O'rtacha hal qilish (soat)"]]
+            for region, count, completed, resolved_count, resolution_seconds in region_rows:
+                average = f'{resolution_seconds / resolved_count / 3600:.1f}' if resolved_count else 'N/A'
+                region_data.append([region, str(count), str(completed), average])
+            region_table = Table(region_data)
+            region_table.setStyle(TableStyle([
                 ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
                 ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
                 ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 8), # Kichikroq shrift
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
                 ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ('ALIGN', (0, 1), (-1, -1), 'LEFT'),
-                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                ('GRID', (0, 0), (-1, -1), 1, colors.black)
             ]))
+            story.append(region_table)
+            story.append(Spacer(1, 30))
+
+        if total_requests > 0:
+            story.extend(self.analytics_section(get_request_analytics(self.db, start_date, period_end)))
 
-            story.append(detailed_table)
+        if total_requests > 0:
+            story.append(Paragraph("Zayafkalar royxati", self.styles['Heading2']))
+            story.append(Spacer(1, 12))
+
+        rows = iter_report_rows(self.db, start_date, period_end, config.REPORT_TABLE_ROWS)
+        # Jadvallar qatorlar o'qilishi bilan hosil qilinadi, xotirada faqat joriy bo'lak turadi
+        story = StreamingStory(story, self.detail_tables(rows))
 
         doc.build(story)
         return filepath
 
+    def analytics_section(self, analytics: dict) -> list:
+        """Tahlil bo'limi: umumiy ko'rsatkichlar, tumanlar, eng ko'p muddat buzgan muassasalar va texniklar"""
+        table_style = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 8),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black)
+        ])
+        overall = analytics['overall']
+        sections = [
+            ("Tahlil (soat)", [
+                ['', 'Mediana', '90-persentil', 'SLA buzilishi'],
+                ['Birinchi javob', format_hours(overall['response_p50']), format_hours(overall['response_p90']),
+                 format_rate(overall['response_breach_rate'])],
+                ['Hal qilish', format_hours(overall['resolution_p50']), format_hours(overall['resolution_p90']),
+                 format_rate(overall['resolution_breach_rate'])],
+            ]),
+            ("Tumanlar bo'yicha", [['Rayon', 'Soni', 'Javob p50', 'Hal qilish p50', 'Hal qilish p90', 'SLA buzilishi']] + [
+                [row.Index, str(row.requests), format_hours(row.response_p50), format_hours(row.resolution_p50),
+                 format_hours(row.resolution_p90), format_rate(row.sla_breach_rate)]
+                for row in analytics['districts'].itertuples()
+            ]),
+            ("SLA eng ko'p buzilgan tashkilotlar", [['Tashkilot', 'Soni', 'Hal qilish p50', 'Hal qilish p90', 'SLA buzilishi']] + [
+                [Paragraph(row.Index, self.styles['TableText']), str(row.requests), format_hours(row.resolution_p50),
+                 format_hours(row.resolution_p90), format_rate(row.sla_breach_rate)]
+                for row in analytics['institutions'].head(15).itertuples()
+            ]),
+            ("Texniklar", [['Texnik', 'Bajarilgan', 'Kuniga', 'Hal qilish p50', 'SLA buzilishi']] + [
+                [row.Index, str(row.resolved), f'{row.per_day:.2f}', format_hours(row.resolution_p50),
+                 format_rate(row.sla_breach_rate)]
+                for row in analytics['technicians'].itertuples()
+            ]),
+        ]
+
+        story = []
+        for title, data in sections:
+            if len(data) < 2:
+                continue
+            story.append(Paragraph(title, self.styles['Heading2']))
+            story.append(Spacer(1, 12))
+            table = Table(data, repeatRows=1)
+            table.setStyle(table_style)
+            story.append(table)
+            story.append(Spacer(1, 30))
+        return story
+
+    def detail_row(self, req) -> list:
+        reason_text = req.reason
+        if len(reason_text) > 50: # Cheklovni 50 belgiga tushirdik
+            reason_text = reason_text[:50] + '...'
+
+        resolution_text = req.resolution_details or "N/A" # Yangi
+        if len(resolution_text) > 50:
+            resolution_text = resolution_text[:50] + '...'
+
+        return [
+            Paragraph(str(req.id), self.styles['TableText']),
+            Paragraph(req.full_name or 'N/A', self.styles['TableText']),
+            Paragraph(req.region, self.styles['TableText']),
+            Paragraph(req.district, self.styles['TableText']),
+            Paragraph(req.institution, self.styles['TableText']),
+            Paragraph(reason_text, self.styles['TableText']),
+            Paragraph(req.pc_number or 'N/A', self.styles['TableText']), # PC raqami
+            Paragraph(req.status.title(), self.styles['TableText']),
+            Paragraph(req.created_at.strftime('%Y-%m-%d %H:%M'), self.styles['TableText']),
+            Paragraph(resolution_text, self.styles['TableText']), # Ish bajarildi izohi
+        ]
+
+    def detail_tables(self, rows, chunk_size: Optional[int] = None):
+        """Qatorlarni sahifa o'lchamidagi jadvallarga bo'lib beradi (sarlavha har jadvalda takrorlanadi)"""
+        chunk_size = chunk_size or config.REPORT_TABLE_ROWS
+        header = ['ID', 'Foydalanuvchi', 'Region', 'Rayon', 'Tashkilot', 'Sababi', 'PC', 'Status', 'Sozdano', 'Ish bajarildi'] # Yangi ustun 'PC' va 'Ish bajarildi'
+
+        # Ustunlarning aniq kengliklari (umumiy 540 punkt)
+        col_widths = [
+            20,  # ID
+            60,  # Polzovatel
+            60,  # Region
+            60,  # Rayon
+            80,  # Uchrezhdeniye
+            70,  # Prichina (qisqartirilgan)
+            30,  # PC
+            40,  # Status
+            70,  # Sozdano
+            50 # Ish bajarildi
+        ]
+
+        table_style = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 8), # Kichikroq shrift
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('ALIGN', (0, 1), (-1, -1), 'LEFT'),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ])
+
+        rows = iter(rows)
+        while True:
+            chunk = [self.detail_row(req) for req in itertools.islice(rows, chunk_size)]
+            if not chunk:
+                return
+            # repeatRows=1: bo'lak sahifaga sig'masa sarlavha keyingi sahifada ham chiqadi
+            detailed_table = LongTable([header] + chunk, colWidths=col_widths, repeatRows=1)
+            detailed_table.setStyle(table_style)
+            yield detailed_table
+
+
+# ReportLab build() flowable'larni ro'yxat boshidan birma-bir oladi; bu ro'yxat
+# keyingi elementlarni generatordan faqat kerak bo'lganda to'ldiradi.
+class StreamingStory(list):
+    def __init__(self, head: list, tail):
+        super().__init__(head)
+        self.tail = tail
+
+    def __len__(self):
+        # keepWithNext keyingi elementga qaraydi, shuning uchun kamida ikkitasi tayyor turadi
+        while self.tail is not None and super().__len__() < 2:
+            item = next(self.tail, None)
+            if item is None:
+                self.tail = None
+            else:
+                self.append(item)
+        return super().__len__()
 
 
+def build_report(start_date: datetime, end_date: datetime, filepath: Optional[str] = None) -> str:
+    """Hisobotni alohida jarayonda yaratish (report_executor ichida chaqiriladi)"""
+    if filepath is None:
+        return with_session(lambda db: PDFReportGenerator(db).generate_report(start_date, end_date))
+    # Vaqtinchalik faylga yoziladi: boshqa so'rovlar yarim yozilgan PDF'ni ko'rmaydi
+    tmp_path = f"{filepath}.{os.getpid()}.tmp"
+    with_session(lambda db: PDFReportGenerator(db).generate_report(start_date, end_date, tmp_path))
+    os.replace(tmp_path, filepath)
+    return filepath
+
+
+# PDF hisobotlar alohida jarayonlarda quriladi, event loop va DB oqimlari band bo'lmaydi.
+# spawn: bola jarayon ota jarayonning SQLite ulanishlari va oqimlarini meros qilib olmaydi.
+report_executor = ProcessPoolExecutor(
+    max_workers=config.REPORT_WORKERS, mp_context=multiprocessing.get_context('spawn')
+)
+# Fon vazifalariga havola saqlanadi, aks holda ular yig'ib olinishi mumkin
+background_tasks = set()
+
+
+def start_background_task(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+# Hisobot keshi: kalit (davr, arizalar versiyasi). Ma'lumot o'zgarmagan bo'lsa tayyor fayl qaytariladi,
+# bir xil kalit uchun parallel so'rovlar bitta yaratishni kutadi.
+class ReportCache:
+    def __init__(self, directory: str, max_mb: int, max_age_days: int):
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        self.max_age = max_age_days * 86400
+        self.inflight: Dict[tuple, asyncio.Future] = {}
+
+    def path_for(self, start_date: datetime, end_date: datetime, watermark: tuple) -> str:
+        digest = hashlib.sha1(repr(watermark).encode()).hexdigest()[:12]
+        filename = f"report_{start_date.strftime('%Y%m%d')}_to_{end_date.strftime('%Y%m%d')}_{digest}.pdf"
+        return os.path.join(self.directory, filename)
+
+    async def report_path(self, start_date: datetime, end_date: datetime) -> str:
+        """Joriy ma'lumotlarga mos hisobot fayli yo'li (fayl hali mavjud bo'lmasligi mumkin)"""
+        period_end = end_date + timedelta(days=1, seconds=-1)
+        watermark = await run_db(with_session, get_report_watermark, start_date, period_end)
+        return self.path_for(start_date, end_date, watermark)
+
+    async def get_report(self, start_date: datetime, end_date: datetime) -> str:
+        filepath = await self.report_path(start_date, end_date)
+        return await self.ensure_report(start_date, end_date, filepath)
+
+    async def ensure_report(self, start_date: datetime, end_date: datetime, filepath: str) -> str:
+        if os.path.exists(filepath):
+            return filepath
+
+        future = self.inflight.get(filepath)
+        if future is None:
+            future = asyncio.ensure_future(self._build(start_date, end_date, filepath))
+            self.inflight[filepath] = future
+            future.add_done_callback(lambda _: self.inflight.pop(filepath, None))
+        # shield: bitta kutuvchi bekor qilinsa, boshqalar uchun yaratish davom etadi
+        return await asyncio.shield(future)
+
+    async def _build(self, start_date: datetime, end_date: datetime, filepath: str) -> str:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(report_executor, build_report, start_date, end_date, filepath)
+        await asyncio.to_thread(self.evict, keep=filepath)
+        # file_id Telegram'da fayl o'chirilganidan keyin ham ishlaydi, shuning uchun uzoqroq saqlanadi
+        await run_db(with_write_session, purge_report_files, datetime.now() - timedelta(seconds=self.max_age * 2))
+        return filepath
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """Eski fayllarni o'chirish, so'ng umumiy hajm chegaradan oshsa eng eskilaridan boshlab"""
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith('.pdf'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+
+        now = time.time()
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in files:
+            if path == keep:
+                continue
+            if now - mtime > self.max_age or total > self.max_bytes:
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError as e:
+                    logging.warning(f"Hisobot faylini o'chirib bo'lmadi {path}: {e}")
+
+
+report_cache = ReportCache(config.REPORTS_DIR, config.REPORT_CACHE_MAX_MB, config.REPORT_CACHE_MAX_AGE_DAYS)
+
+
+
+
+# Bir vaqtda qayta ishlanadigan update'lar soniga chegara (webhook ham, polling ham
+# update'larni alohida vazifalarda ishlaydi). DbSessionMiddleware'dan oldin ulanadi.
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    def __init__(self, limit: int):
+        self.semaphore = asyncio.Semaphore(limit)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        async with self.semaphore:
+            return await handler(event, data)
+
+
+# Webhook rejimida: Telegram qayta yuborgan yoki boshqa worker allaqachon olgan update o'tkazib yuboriladi
+class UpdateDedupMiddleware(BaseMiddleware):
+    def __init__(self, retention_hours: int):
+        self.retention = timedelta(hours=retention_hours)
+        self._last_purge = 0.0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if time.monotonic() - self._last_purge > 3600:
+            self._last_purge = time.monotonic()
+            start_background_task(run_db(with_write_session, purge_processed_updates, datetime.now() - self.retention))
+        if not await run_db(with_write_session, claim_update, event.update_id):
+            logging.info(f"Update {event.update_id} allaqachon qayta ishlangan, o'tkazib yuborildi")
+            return None
+        return await handler(event, data)
+
+
+# Har bir update uchun bitta DB sessiyasi
+class DbSessionMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        counter = [0]
+        token = query_counter.set(counter)
+        db = SessionLocal()
+        data['db'] = db
+        try:
+            result = await handler(event, data)
+            await run_db(db.commit)
+            return result
+        except Exception:
+            await run_db(db.rollback)
+            raise
+        finally:
+            await run_db(db.close)
+            query_counter.reset(token)
+            if isinstance(event, Update):
+                logging.debug(f"Update {event.update_id}: {counter[0]} ta SQL so'rov")
+
+
+# Token bucket: rate xabar/soniya, capacity gacha portlashga ruxsat
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Bitta tokenni band qiladi va yuborishdan oldin kutish kerak bo'lgan vaqtni qaytaradi"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_idle(self) -> bool:
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+    async def acquire(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# Botni bloklagan chatlar ro'yxati (xotirada + blocked_chats jadvalida).
+# retry_hours o'tgach chatga yana bir marta urinib ko'riladi, /start bosilsa ro'yxatdan chiqariladi.
+class BlockedChatRegistry:
+    def __init__(self, retry_hours: int):
+        self.retry_after = timedelta(hours=retry_hours)
+        self.blocked = {}  # chat_id -> blocked_at
+
+    def load(self, db: Session) -> None:
+        self.blocked = get_blocked_chats(db)
+
+    def should_skip(self, chat_id: int) -> bool:
+        blocked_at = self.blocked.get(chat_id)
+        return blocked_at is not None and datetime.now() - blocked_at < self.retry_after
+
+    async def mark(self, chat_id: int, reason: str) -> None:
+        blocked_at = datetime.now()
+        self.blocked[chat_id] = blocked_at
+        await run_db(with_write_session, save_blocked_chat, chat_id, reason, blocked_at)
+
+    async def reset(self, chat_id: int) -> None:
+        if self.blocked.pop(chat_id, None) is not None:
+            await run_db(with_write_session, delete_blocked_chat, chat_id)
+
+
+def is_unreachable_chat_error(error: Exception) -> bool:
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    return isinstance(error, TelegramBadRequest) and 'chat not found' in str(error).lower()
+
+
+# Xabarlarni fon rejimida, cheklangan parallellik va tezlik bilan yuborish.
+# Handlerlar submit() qilib darhol qaytadi, xabarlar navbatdan yuboriladi.
+class NotificationDispatcher:
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self, bot: Bot, workers: int, global_rate: float, chat_rate: float, max_retries: int,
+                 blocked: BlockedChatRegistry):
+        self.bot = bot
+        self.blocked = blocked
+        self.workers = workers
+        self.max_retries = max_retries
+        self.chat_rate = chat_rate
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self.chat_buckets = {}
+        self.queue = asyncio.Queue()
+        self.resume_at = 0.0  # RetryAfter kelganda barcha yuborishlar shu vaqtgacha to'xtaydi
+        self._tasks = []
+
+    def submit(self, chat_id: int, text: str, **kwargs) -> asyncio.Future:
+        """Xabarni navbatga qo'yadi; future True (yetkazildi), False (xato) yoki None (chat bloklangan) qaytaradi"""
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((chat_id, text, kwargs, future))
+        return future
+
+    async def start(self) -> None:
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self) -> None:
+        await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= self.MAX_CHAT_BUCKETS:
+                self.chat_buckets = {k: b for k, b in self.chat_buckets.items() if not b.is_idle()}
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate)
+        return bucket
+
+    async def _worker(self) -> None:
+        while True:
+            chat_id, text, kwargs, future = await self.queue.get()
+            try:
+                delivered = await self._send(chat_id, text, kwargs)
+            except Exception as e:
+                logging.error(f"Xabar yuborishda kutilmagan xato ({chat_id}): {e}")
+                delivered = False
+            finally:
+                self.queue.task_done()
+            if not future.done():
+                future.set_result(delivered)
+
+    async def _send(self, chat_id: int, text: str, kwargs: dict) -> Optional[bool]:
+        if self.blocked.should_skip(chat_id):
+            return None
+        for attempt in range(self.max_retries + 1):
+            pause = self.resume_at - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await self.global_bucket.acquire()
+            await self._chat_bucket(chat_id).acquire()
+            try:
+                await self.bot.send_message(chat_id, text, **kwargs)
+                return True
+            except TelegramRetryAfter as e:
+                logging.warning(f"Flood limit: {e.retry_after} soniya kutamiz ({chat_id})")
+                self.resume_at = max(self.resume_at, time.monotonic() + e.retry_after)
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                if not is_unreachable_chat_error(e):
+                    logging.error(f"Xabarni {chat_id} ga yuborib bo'lmadi: {e}")
+                    return False
+                logging.info(f"Chat {chat_id} mavjud emas yoki botni bloklagan, keyingi xabarlar o'tkazib yuboriladi")
+                await self.blocked.mark(chat_id, str(e))
+                return None
+            except Exception as e:
+                logging.error(f"Xabarni {chat_id} ga yuborib bo'lmadi: {e}")
+                return False
+        return False
+
+
+# Outbox jadvalini notifier orqali yuborib, natijani bazada belgilaydigan fon vazifasi.
+# Yuborilgan lekin belgilanmagan xabarlar qayta ishga tushganda yana yuboriladi (at-least-once).
+# Muvaffaqiyatsiz xabar next_attempt_at kelguncha olinmaydi (eksponensial kutish), max_attempts dan keyin 'failed'.
+class OutboxWorker:
+    def __init__(self, notifier: NotificationDispatcher, batch_size: int, poll_interval: float, max_attempts: int,
+                 retry_base_seconds: float, retry_max_seconds: float):
+        self.notifier = notifier
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = None
+        self._last_purge = 0.0
+
+    def wake(self) -> None:
+        """Yangi xabarlar yozilganda darhol yuborishni boshlash"""
+        self.wakeup.set()
+
+    async def start(self) -> None:
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Yangi xabar olishni to'xtatadi va yuborilayotganlarini kutib, belgilaydi"""
+        self._stopping = True
+        self.wake()
+        if self._task:
+            await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        inflight = {}  # future -> outbox id
+        while True:
+            if not self._stopping and len(inflight) < self.batch_size:
+                self.wakeup.clear()
+                try:
+                    rows = await run_db(
+                        with_session, fetch_pending_outbox, self.batch_size - len(inflight), list(inflight.values())
+                    )
+                except Exception as e:
+                    logging.error(f"Outbox'ni o'qishda xato: {e}")
+                    rows = []
+                for row in rows:
+                    inflight[self.notifier.submit(row.chat_id, row.text)] = row.id
+
+            if not inflight:
+                if self._stopping:
+                    return
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    await self._purge_if_due()
+                continue
+
+            done, _ = await asyncio.wait(inflight, timeout=0.5, return_when=asyncio.FIRST_COMPLETED)
+            if done:
+                results = [(inflight.pop(future), future.result()) for future in done]
+                try:
+                    await run_db(with_write_session, mark_outbox_results, results, self.max_attempts,
+                                 self.retry_base_seconds, self.retry_max_seconds)
+                except Exception as e:
+                    logging.error(f"Outbox natijalarini yozishda xato: {e}")
+
+    async def _purge_if_due(self) -> None:
+        # Eski yuborilgan xabarlarni soatiga bir marta tozalash
+        if time.monotonic() - self._last_purge < 3600:
+            return
+        self._last_purge = time.monotonic()
+        older_than = datetime.now() - timedelta(days=config.OUTBOX_RETENTION_DAYS)
+        try:
+            await run_db(with_write_session, purge_sent_outbox, older_than)
+        except Exception as e:
+            logging.error(f"Outbox'ni tozalashda xato: {e}")
+
+
+# FSM holatlari bazada saqlanadi. O'qishlar xotiradagi keshdan, o'zgarishlar esa
+# flush_interval oralig'ida bitta tranzaksiyada yoziladi. ttl davomida ishlatilmagan holatlar o'chiriladi.
+# shared=True (bir nechta worker): foydalanuvchining keyingi update'i boshqa jarayonga tushishi mumkin,
+# shuning uchun kesh ishlatilmaydi - har safar bazadan o'qiladi va darhol yoziladi.
+class DatabaseStorage(BaseStorage):
+    def __init__(self, flush_interval: float, ttl_hours: int, cache_size: int, shared: bool = False):
+        self.flush_interval = flush_interval
+        self.shared = shared
+        self.ttl = ttl_hours * 3600
+        self.cache_size = cache_size
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._records = OrderedDict()  # kalit -> [state, data, oxirgi murojaat vaqti]
+        self._dirty = set()
+        self._stopping = asyncio.Event()
+        self._task = None
+        self._last_purge = 0.0
+
+    async def _record(self, key: StorageKey) -> list:
+        storage_key = self.key_builder.build(key)
+        if self.shared:
+            row = await run_db(with_session, load_fsm_record, storage_key)
+            state, data = row if row else (None, {})
+            return [state, data, time.monotonic()]
+        record = self._records.get(storage_key)
+        if record is None:
+            row = await run_db(with_session, load_fsm_record, storage_key)
+            # Bazadan o'qilayotganda shu kalitga yozilgan bo'lishi mumkin
+            record = self._records.get(storage_key)
+            if record is None:
+                state, data = row if row else (None, {})
+                record = [state, data, 0.0]
+                self._records[storage_key] = record
+        self._records.move_to_end(storage_key)
+        record[2] = time.monotonic()
+        return record
+
+    async def _mark_dirty(self, key: StorageKey, record: list) -> None:
+        storage_key = self.key_builder.build(key)
+        if self.shared:
+            await run_db(with_write_session, save_fsm_records, [(storage_key, record[0], record[1], datetime.now())])
+        else:
+            self._dirty.add(storage_key)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record(key)
+        record[0] = state.state if isinstance(state, State) else state
+        await self._mark_dirty(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(key))[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._record(key)
+        record[1] = dict(data)
+        await self._mark_dirty(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._record(key))[1].copy()
+
+    async def start(self) -> None:
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Fon vazifasini to'xtatib, yozilmagan o'zgarishlarni bazaga yozadi"""
+        self._stopping.set()
+        if self._task:
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        if not self._dirty:
+            return
+        keys, self._dirty = self._dirty, set()
+        now = datetime.now()
+        records = [(key, self._records[key][0], self._records[key][1], now) for key in keys if key in self._records]
+        try:
+            await run_db(with_write_session, save_fsm_records, records)
+        except Exception as e:
+            logging.error(f"FSM holatlarini yozishda xato: {e}")
+            self._dirty |= keys
+
+    def _evict(self) -> None:
+        # Eng eski murojaat qilinganlardan boshlab; hali yozilmaganlar qoldiriladi
+        expires = time.monotonic() - self.ttl
+        for key in list(self._records):
+            if len(self._records) <= self.cache_size and self._records[key][2] >= expires:
+                break
+            if key not in self._dirty:
+                del self._records[key]
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+            # get_state ham keshga qo'shadi: yozuv bo'lmasa ham hajm va TTL cheklanadi
+            self._evict()
+            await self._purge_if_due()
+
+    async def _purge_if_due(self) -> None:
+        if time.monotonic() - self._last_purge < 3600:
+            return
+        self._last_purge = time.monotonic()
+        try:
+            await run_db(with_write_session, purge_fsm_records, datetime.now() - timedelta(seconds=self.ttl))
+        except Exception as e:
+            logging.error(f"Eski FSM holatlarini o'chirishda xato: {e}")
+
+
+# Bir nechta worker'da: boshqa jarayon o'zgartirgan foydalanuvchilar, geografiya va bloklangan
+# chatlar keshini cache_generations orqali qayta yuklash. Statistika keshi TTL bilan eskiradi.
+class CacheSync:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.generations = {}
+        self._stopping = asyncio.Event()
+        self._task = None
+
+    def check(self, db: Session) -> None:
+        generations = get_cache_generations(db)
+        changed = {name for name, value in generations.items() if self.generations.get(name) != value}
+        self.generations = generations
+        if 'users' in changed:
+            user_cache.clear()
+            routing.load(db)
+        if 'geography' in changed:
+            geography.load(db)
+        if 'blocked_chats' in changed:
+            blocked_chats.load(db)
+
+    async def start(self) -> None:
+        await run_db(with_session, self.check)
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if self._task:
+            await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await run_db(with_session, self.check)
+            except Exception as e:
+                logging.error(f"Kesh versiyalarini tekshirishda xato: {e}")
+
+
+# Arizalarni yaratish va statusini o'zgartirish uchun guruhli commit: max_delay ichida kelgan
+# yozuvlar bitta tranzaksiyada (SQLite'da bitta fsync) yoziladi, har bir chaqiruvchi o'z natijasini oladi.
+class WriteQueue:
+    def __init__(self, max_delay_ms: float, max_batch: int):
+        self.max_delay = max_delay_ms / 1000
+        self.max_batch = max_batch
+        self.queue: Optional[asyncio.Queue] = None
+        self._task = None
+
+    async def submit(self, fn, *args, **kwargs):
+        """fn(db, *args, **kwargs) commit qilingandan keyin uning natijasini qaytaradi"""
+        if self._task is None:
+            # Navbat ishga tushirilmagan (masalan, skriptlardan chaqirilganda) - darhol yoziladi
+            [(ok, value)] = await run_db(with_session, apply_write_batch, [(fn, args, kwargs)])
+            if not ok:
+                raise value
+            return value
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((fn, args, kwargs, future))
+        return await future
+
+    async def start(self) -> None:
+        self.queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Navbatdagi yozuvlarni commit qilib to'xtaydi"""
+        if self._task:
+            await self.queue.put(None)
+            await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._commit(batch)
+
+    async def _commit(self, batch: List[tuple]) -> None:
+        try:
+            results = await run_db(with_session, apply_write_batch, [(fn, args, kwargs) for fn, args, kwargs, _ in batch])
+        except Exception as e:
+            logging.error(f"{len(batch)} ta yozuvni commit qilishda xato: {e}")
+            results = [(False, e)] * len(batch)
+        for (*_, future), (ok, value) in zip(batch, results):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
 
 # Initsializatsiya bota
 bot = Bot(token=config.BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+blocked_chats = BlockedChatRegistry(config.BLOCKED_RETRY_HOURS)
+notifier = NotificationDispatcher(
+    bot, config.NOTIFY_WORKERS, config.NOTIFY_GLOBAL_RATE, config.NOTIFY_CHAT_RATE, config.NOTIFY_MAX_RETRIES,
+    blocked_chats
+)
+# Xabarlarni faqat 0-worker yuboradi (umumiy rate limit); boshqa worker'lar yozgan xabarlar
+# wake() o'rniga so'rov oralig'ida olinadi, shuning uchun u qisqaroq
+outbox = OutboxWorker(
+    notifier, config.OUTBOX_BATCH_SIZE,
+    config.OUTBOX_POLL_INTERVAL if config.WORKERS == 1 else min(config.OUTBOX_POLL_INTERVAL, config.CACHE_SYNC_INTERVAL),
+    config.OUTBOX_MAX_ATTEMPTS, config.OUTBOX_RETRY_BASE_SECONDS, config.OUTBOX_RETRY_MAX_SECONDS
+)
+fsm_storage = DatabaseStorage(
+    config.FSM_FLUSH_INTERVAL, config.FSM_STATE_TTL_HOURS, config.FSM_CACHE_SIZE, shared=config.WORKERS > 1
+)
+cache_sync = CacheSync(config.CACHE_SYNC_INTERVAL)
+write_queue = WriteQueue(config.WRITE_BATCH_DELAY_MS, config.WRITE_BATCH_SIZE)
+dp = Dispatcher(storage=fsm_storage)
 router = Router()
 
 
@@ -597,9 +2616,9 @@ def initialize_sample_data():
 
 # Obrabotchiki
 @router.message(Command("start"))
-async def start_handler(message: Message, state: FSMContext):
-    db = SessionLocal()
-    user = get_user_by_telegram_id(db, message.from_user.id)
+async def start_handler(message: Message, state: FSMContext, db: Session):
+    await blocked_chats.reset(message.chat.id)
+    user = await get_user_info(db, message.from_user.id)
 
     if user:
         if user.role == 'admin':
@@ -616,13 +2635,11 @@ async def start_handler(message: Message, state: FSMContext):
         )
         await state.set_state(UserRegistration.waiting_for_region)
 
-    db.close()
-
 
 @router.message(Command("texstart"))
-async def technician_start_handler(message: Message, state: FSMContext):
-    db = SessionLocal()
-    user = get_user_by_telegram_id(db, message.from_user.id)
+async def technician_start_handler(message: Message, state: FSMContext, db: Session):
+    await blocked_chats.reset(message.chat.id)
+    user = await get_user_info(db, message.from_user.id)
 
     if user:
         if user.role == 'technician':
@@ -637,57 +2654,167 @@ async def technician_start_handler(message: Message, state: FSMContext):
         )
         await state.set_state(TechnicianRegistration.waiting_for_region)
 
-    db.close()
-
 
 @router.message(Command("adminstart"))
-async def admin_start_handler(message: Message, state: FSMContext):
+async def admin_start_handler(message: Message, state: FSMContext, db: Session):
     if message.from_user.id not in config.ADMIN_IDS:
         await message.answer("❌ У вас нет разрешения на доступ к панели администратора.")
         return
 
-    db = SessionLocal()
-    user = get_user_by_telegram_id(db, message.from_user.id)
+    user = await run_db(get_user_by_telegram_id, db, message.from_user.id)
 
     if not user:
-        user = create_user(
+        user = await run_db(
+            create_user,
             db, message.from_user.id, "Админ", "Админ", "Админ",
             message.from_user.full_name or "Администратор", "Администратор", "admin"
         )
     elif user.role != 'admin':
-        user.role = 'admin'
-        db.commit()
+        await run_db(set_user_role, db, user, 'admin')
 
     await message.answer("Добро пожаловать, Администратор! 👋", reply_markup=create_admin_keyboard())
-    db.close()
+
+
+def parse_report_period(args: Optional[str], today: date) -> Optional[tuple]:
+    """/report argumentlari: bo'sh (joriy hafta), "month [YYYY-MM]", "year [YYYY]" yoki "YYYY-MM-DD YYYY-MM-DD"."""
+    parts = (args or '').split()
+    try:
+        if not parts:
+            start = today - timedelta(days=today.weekday())
+            return start, start + timedelta(days=6), "📊 Еженедельный отчет"
+        if parts[0] == 'month' and len(parts) <= 2:
+            start = datetime.strptime(parts[1], '%Y-%m').date() if len(parts) == 2 else today.replace(day=1)
+            next_month = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+            return start, next_month - timedelta(days=1), "📊 Месячный отчет"
+        if parts[0] == 'year' and len(parts) <= 2:
+            year = int(parts[1]) if len(parts) == 2 else today.year
+            return date(year, 1, 1), date(year, 12, 31), "📊 Годовой отчет"
+        if len(parts) == 2:
+            start = datetime.strptime(parts[0], '%Y-%m-%d').date()
+            end = datetime.strptime(parts[1], '%Y-%m-%d').date()
+            if start <= end:
+                return start, end, "📊 Отчет за период"
+    except ValueError:
+        pass
+    return None
 
 
 @router.message(Command("report"))
-async def generate_report_handler(message: Message):
-    db = SessionLocal()
-    user = get_user_by_telegram_id(db, message.from_user.id)
+async def generate_report_handler(message: Message, db: Session, command: Optional[CommandObject] = None):
+    user = await get_user_info(db, message.from_user.id)
 
     if not user or user.role != 'admin':
         await message.answer("❌ У вас нет разрешения на генерацию отчетов.")
-        db.close()
         return
 
-    await message.answer("📊 Генерация еженедельного отчета...")
+    period = parse_report_period(command.args if command else None, datetime.now().date())
+    if period is None:
+        await message.answer(
+            "❌ Неверный период. Примеры:\n"
+            "/report — текущая неделя\n"
+            "/report month 2026-09\n"
+            "/report year 2026\n"
+            "/report 2026-09-01 2026-09-15"
+        )
+        return
+    start_day, end_day, caption = period
+    start_date = datetime.combine(start_day, datetime.min.time())
+    end_date = datetime.combine(end_day, datetime.min.time())
+
+    await message.answer("📊 Генерация отчета... Отчет будет отправлен, как только он будет готов.")
 
-    today = datetime.now()
-    start_of_week = today - timedelta(days=today.weekday())
-    end_of_week = start_of_week + timedelta(days=6)
+    # Handler darhol qaytadi, hisobot tayyor bo'lgach alohida yuboriladi
+    start_background_task(deliver_report(message, start_date, end_date, caption))
 
-    report_generator = PDFReportGenerator(db)
-    filepath = report_generator.generate_weekly_report(start_of_week, end_of_week)
 
+async def deliver_report(message: Message, start_date: datetime, end_date: datetime, caption: str):
     try:
-        document = FSInputFile(filepath)
-        await message.answer_document(document, caption="📊 Еженедельный отчет")
+        filepath = await report_cache.report_path(start_date, end_date)
+        filename = os.path.basename(filepath)
+
+        # Hisobot o'zgarmagan bo'lsa, avval yuklangan fayl file_id orqali qayta yuboriladi
+        file_id = await run_db(with_session, get_report_file_id, filename)
+        if file_id:
+            try:
+                await message.answer_document(file_id, caption=caption)
+                return
+            except TelegramBadRequest as e:
+                logging.warning(f"Hisobot file_id yaroqsiz {filename}: {e}")
+                await run_db(with_write_session, delete_report_file_id, filename)
+
+        await report_cache.ensure_report(start_date, end_date, filepath)
+        sent_message = await message.answer_document(FSInputFile(filepath), caption=caption)
+        if sent_message.document:
+            await run_db(with_write_session, save_report_file_id, filename, sent_message.document.file_id)
     except Exception as e:
+        logging.error(f"Hisobot yaratishda xato: {e}")
         await message.answer(f"❌ Ошибка при генерации отчета: {str(e)}")
 
-    db.close()
+
+@router.message(Command("analytics"))
+async def analytics_handler(message: Message, command: CommandObject, db: Session):
+    user = await get_user_info(db, message.from_user.id)
+    if not user or user.role != 'admin':
+        await message.answer("❌ У вас нет разрешения на просмотр аналитики.")
+        return
+
+    period = parse_report_period(command.args, datetime.now().date())
+    if period is None:
+        await message.answer("❌ Неверный период. Используйте те же аргументы, что и для /report.")
+        return
+    start_day, end_day, _ = period
+    start_date = datetime.combine(start_day, datetime.min.time())
+    end_date = datetime.combine(end_day, datetime.max.time())
+
+    analytics = await run_db(get_request_analytics, db, start_date, end_date)
+    overall = analytics['overall']
+    if not overall['requests']:
+        await message.answer("📈 За этот период заявок нет.")
+        return
+
+    lines = [
+        f"📈 Аналитика {start_day} — {end_day}",
+        f"Заявок: {overall['requests']}",
+        f"Первый ответ, ч: медиана {format_hours(overall['response_p50'])}, p90 {format_hours(overall['response_p90'])}, "
+        f"нарушение SLA ({config.SLA_RESPONSE_HOURS:g} ч): {format_rate(overall['response_breach_rate'])}",
+        f"Решение, ч: медиана {format_hours(overall['resolution_p50'])}, p90 {format_hours(overall['resolution_p90'])}, "
+        f"нарушение SLA ({config.SLA_RESOLUTION_HOURS:g} ч): {format_rate(overall['resolution_breach_rate'])}",
+    ]
+    technicians = analytics['technicians'].head(5)
+    if not technicians.empty:
+        lines.append("\n👨‍🔧 Техники:")
+        # itertuples ustun turlarini saqlaydi (iterrows sonlarni float qilib "5.0" chiqaradi)
+        for row in technicians.itertuples():
+            lines.append(f"- {row.Index}: {row.resolved} ({row.per_day:.2f}/день), медиана {format_hours(row.resolution_p50)} ч")
+    institutions = analytics['institutions'].head(5)
+    lines.append("\n⚠️ Больше всего нарушений SLA:")
+    for row in institutions.itertuples():
+        lines.append(f"- {row.Index}: {format_rate(row.sla_breach_rate)} из {row.requests}")
+
+    await message.answer("\n".join(lines))
+
+
+# (Qo'shilgan) Outbox holati; "/outbox replay" muvaffaqiyatsiz xabarlarni qayta navbatga qo'yadi
+@router.message(Command("outbox"))
+async def outbox_handler(message: Message, command: CommandObject, db: Session):
+    user = await get_user_info(db, message.from_user.id)
+    if not user or user.role != 'admin':
+        await message.answer("❌ Ruxsat yo'q")
+        return
+
+    requeued = 0
+    if (command.args or '').strip() == 'replay':
+        requeued = await run_db(requeue_failed_outbox, db)
+        outbox.wake()
+
+    counts = await run_db(get_outbox_counts, db)
+    await message.answer(
+        "📤 Outbox holati:\n\n"
+        f"⏳ Navbatda: {counts.get('pending', 0)}\n"
+        f"✅ Yuborilgan: {counts.get('sent', 0)}\n"
+        f"❌ Yuborilmagan: {counts.get('failed', 0)}\n"
+        f"🔁 Qayta navbatga qo'yildi: {requeued}"
+    )
 
 
 # Sostoyaniya registratsii polzovatelya
@@ -756,7 +2883,7 @@ async def process_user_full_name(message: Message, state: FSMContext):
 
 
 @router.message(StateFilter(UserRegistration.waiting_for_position), F.text)
-async def process_user_position(message: Message, state: FSMContext):
+async def process_user_position(message: Message, state: FSMContext, db: Session):
     if message.text == "Отмена":
         await state.clear()
         await message.answer("Регистрация отменена.", reply_markup=ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text="/start")]], resize_keyboard=True))
@@ -764,12 +2891,11 @@ async def process_user_position(message: Message, state: FSMContext):
 
     data = await state.get_data()
 
-    db = SessionLocal()
-    user = create_user(
+    user = await run_db(
+        create_user,
         db, message.from_user.id, data['region'], data['district'],
         data['institution'], data['full_name'], message.text
     )
-    db.close()
 
     await state.clear()
     await message.answer(
@@ -864,7 +2990,7 @@ async def process_technician_position(message: Message, state: FSMContext):
     await state.set_state(TechnicianRegistration.waiting_for_phone)
 
 @router.message(StateFilter(TechnicianRegistration.waiting_for_phone), F.text)
-async def process_technician_phone(message: Message, state: FSMContext):
+async def process_technician_phone(message: Message, state: FSMContext, db: Session):
     if message.text == "Отмена":
         await state.clear()
         await message.answer("Регистрация отменена.", reply_markup=ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text="/texstart")]], resize_keyboard=True))
@@ -877,18 +3003,16 @@ async def process_technician_phone(message: Message, state: FSMContext):
         return
 
     data = await state.get_data()
-    db = SessionLocal()
-    user = create_user(
+    user = await run_db(
+        create_user,
         db, message.from_user.id,
         data['region'], data['district'],
         data['institution'],
         data['full_name'],
         data['position'],
-        'technician'
+        'technician',
+        phone_number  # Telefon raqamini qo'shamiz
     )
-    user.phone_number = phone_number  # Telefon raqamini qo'shamiz
-    db.commit()
-    db.close()
 
     await state.clear()
     await message.answer(
@@ -900,15 +3024,13 @@ async def process_technician_phone(message: Message, state: FSMContext):
 
 
 @router.message(F.text == "🔧 Texniklar haqida ma'lumot")
-async def admin_technicians_info(message: Message):
-    db = SessionLocal()
-    user = get_user_by_telegram_id(db, message.from_user.id)
+async def admin_technicians_info(message: Message, db: Session):
+    user = await get_user_info(db, message.from_user.id)
     if not user or user.role != 'admin':
         await message.answer("❌ Ruxsat yo'q")
-        db.close()
         return
 
-    technicians = db.query(User).filter(User.role == 'technician').order_by(User.region, User.district).all()
+    technicians = await run_db(get_technicians, db)
 
     if not technicians:
         await message.answer("❌ Texniklar topilmadi")
@@ -925,18 +3047,14 @@ async def admin_technicians_info(message: Message):
             )
         await message.answer(response, parse_mode='HTML')
 
-    db.close()
-
 
 
 # Sostoyaniya otpravki zayavki
 @router.message(F.text == "📝 Отправить заявку")
-async def submit_request_handler(message: Message, state: FSMContext):
-    db = SessionLocal()
-    user = get_user_by_telegram_id(db, message.from_user.id)
+async def submit_request_handler(message: Message, state: FSMContext, db: Session):
+    user = await get_user_info(db, message.from_user.id)
     if not user:
         await message.answer("Пожалуйста, сначала зарегистрируйтесь используя /start.")
-        db.close()
         return
 
     await message.answer(
@@ -945,7 +3063,6 @@ async def submit_request_handler(message: Message, state: FSMContext):
         reply_markup=create_regions_keyboard()
     )
     await state.set_state(RequestSubmission.waiting_for_region)
-    db.close()
 
 
 @router.message(StateFilter(RequestSubmission.waiting_for_region), F.text)
@@ -1058,30 +3175,13 @@ async def process_request_submitted_by(message: Message, state: FSMContext):
 
 
 @router.callback_query(StateFilter(RequestSubmission.waiting_for_confirmation))
-async def process_request_confirmation(callback: CallbackQuery, state: FSMContext):
+async def process_request_confirmation(callback: CallbackQuery, state: FSMContext, db: Session):
     if callback.data == "confirm_yes":
         data = await state.get_data()
-        db = SessionLocal()
-
-        user = get_user_by_telegram_id(db, callback.from_user.id)
-
-        request = Request(
-            user_id=user.id,
-            region=data['region'],
-            district=data['district'],
-            institution=data['institution'],
-            reason=data['reason'],
-            floor_room=data['floor_room'],
-            submitted_by=data['submitted_by']
-        )
-
-        db.add(request)
-        db.commit()
-        db.refresh(request)
-
-
-
 
+        user = await get_user_info(db, callback.from_user.id)
+        request = await write_queue.submit(create_request, user.id, data, user.full_name)
+        outbox.wake()
 
         await callback.message.edit_text(
             "✅ Заявка успешно отправлена!\n\n"
@@ -1092,45 +3192,6 @@ async def process_request_confirmation(callback: CallbackQuery, state: FSMContex
 
         )
 
-        admins = db.query(User).filter(User.role == 'admin').all()
-        for admin in admins:
-            try:
-                await bot.send_message(
-                    admin.telegram_id,
-                    f"🔔 Новая заявка #{request.id}\n\n"
-                    f"👤 Пользователь: {user.full_name}\n"
-                    f"🌍 Регион: {request.region}\n"
-                    f"🏘️ Район: {request.district}\n"
-                    f"🏢 Учреждение: {request.institution}\n"
-                    f"📝 Причина: {request.reason}\n"
-                    f"📍 Этаж и комната: {request.floor_room}\n"
-                    f"📅 Дата: {request.created_at.strftime('%Y-%m-%d %H:%M')}\n"
-                )
-            except Exception as e:
-                logging.error(f"Не удалось отправить сообщение администратору {admin.telegram_id}: {e}")
-
-        technicians = db.query(User).filter(
-            User.role == 'technician',
-            User.region == request.region,
-            User.district == request.district,
-            User.institution == request.institution
-        ).all()
-        for technician in technicians:
-            try:
-                await bot.send_message(
-                    technician.telegram_id,
-                    f"🔔 **Вам поступила новая заявка:**\n\n"
-                         f"🆔 **ID:** #{request.id}\n"
-                         f"🏢 **Учреждение:** {request.institution}\n"
-                         f"📝 **Причина:** {request.reason}\n"
-                         f"📍 **Этаж/Комната:** {request.floor_room}\n"
-                         f"➡️ **Статус:** В ожидании\n\n"
-                         "Для возвращения в главное меню нажмите /start"
-                )
-            except Exception as e:
-                logging.error(f"Не удалось отправить сообщение технику {technician.telegram_id}: {e}")
-
-        db.close()
         await state.clear()
     else:
         await callback.message.edit_text("❌ Отправка заявки отменена.", reply_markup=None)
@@ -1141,54 +3202,70 @@ async def process_request_confirmation(callback: CallbackQuery, state: FSMContex
 
 # Obrabotchiki dlya tekhnikov
 @router.message(F.text == "🔧 Просмотреть заявки")
-async def view_technician_requests_handler(message: Message):
-    db = SessionLocal()
-    user = get_user_by_telegram_id(db, message.from_user.id)
+async def view_technician_requests_handler(message: Message, db: Session):
+    user = await get_user_info(db, message.from_user.id)
     if not user or user.role != 'technician':
         await message.answer("❌ У вас нет разрешения на это действие.")
-        db.close()
         return
 
-    requests = db.query(Request).filter(
-        Request.institution == user.institution,
-        Request.status.in_(['pending', 'in_progress'])
-    ).order_by(Request.created_at.desc()).all()
+    # Barcha arizalar bitta xabarda, sahifalar shu xabarni tahrirlash orqali almashtiriladi
+    text, keyboard = await render_technician_requests_page(db, user.institution)
+    await message.answer(text, reply_markup=keyboard)
 
-    if not requests:
-        await message.answer("В вашем учреждении нет активных заявок.")
+
+async def render_technician_requests_page(db: Session, institution: str, direction: str = 'f',
+                                          cursor: Optional[str] = None) -> tuple:
+    rows, has_more = await run_db(
+        get_active_requests_page, db, config.REQUESTS_PAGE_SIZE, institution=institution,
+        cursor=decode_request_cursor(cursor) if cursor else None, newer=direction == 'n'
+    )
+    has_older = has_more if direction != 'n' else True
+    has_newer = has_more if direction == 'n' else direction == 'o'
+
+    if not rows:
+        text = "В вашем учреждении нет активных заявок." if direction == 'f' else "Больше заявок нет."
     else:
-        for req in requests:
-            response_text = (
-                f"🔧 **Активная заявка:**\n\n"
-                f"🆔 **ID:** #{req.id}\n"
-                f"📝 **Причина:** {req.reason}\n"
-                f"📍 **Этаж/Комната:** {req.floor_room}\n"
-                f"➡️ **Статус:** {req.status.title()}\n"
-                f"👤 **Отправил:** {req.submitted_by}\n"
-                f"🗓️ **Дата:** {req.created_at.strftime('%Y-%m-%d %H:%M')}\n"
-            )
-            await message.answer(
-                response_text,
-                reply_markup=create_request_status_keyboard(req.id)
+        text = "🔧 **Активные заявки:**\n\n"
+        for req, _ in rows:
+            reason = req.reason if len(req.reason) <= 100 else req.reason[:100] + '...'
+            text += (
+                f"🆔 **#{req.id}** · {req.status.title()} · {req.created_at.strftime('%Y-%m-%d %H:%M')}\n"
+                f"📝 {reason}\n"
+                f"📍 {req.floor_room} · 👤 {req.submitted_by}\n\n"
             )
+    return text, create_technician_requests_keyboard(rows, has_older, has_newer)
 
-    db.close()
+
+@router.callback_query(F.data.startswith("treq:"))
+async def technician_requests_page_callback(callback: CallbackQuery, db: Session):
+    user = await get_user_info(db, callback.from_user.id)
+    if not user or user.role != 'technician':
+        await callback.answer("❌ У вас нет разрешения на это действие.", show_alert=True)
+        return
+
+    _, direction, cursor = callback.data.split(':', 2)
+    text, keyboard = await render_technician_requests_page(db, user.institution, direction, cursor or None)
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            raise
+    await callback.answer()
 
 # (O'zgartirilgan) Texniklar uchun statusni yangilash handleri (izoh qoldirish uchun)
 @router.callback_query(F.data.startswith("status_"))
-async def initiate_request_status_update(callback: CallbackQuery, state: FSMContext):
+async def initiate_request_status_update(callback: CallbackQuery, state: FSMContext, db: Session):
     try:
-        parts = callback.data.split('_')
-        new_status = parts[1]
-        request_id = int(parts[2])
+        # status_<status>_<id>; statuslarning o'zida ham "_" bor (in_progress, not_completed)
+        prefix, request_id = callback.data.rsplit('_', 1)
+        new_status = prefix[len('status_'):]
+        request_id = int(request_id)
 
-        db = SessionLocal()
-        request = db.query(Request).get(request_id)
-        technician = get_user_by_telegram_id(db, callback.from_user.id)
+        request = await run_db(db.get, Request, request_id)
+        technician = await get_user_info(db, callback.from_user.id)
 
         if not request or request.institution != technician.institution:
             await callback.answer("❌ Sizda bu arizaning statusini o'zgartirishga ruxsat yo'q.", show_alert=True)
-            db.close()
             return
 
         # Agar status "completed" yoki "not_completed" bo'lsa, izoh so'raymiz
@@ -1209,26 +3286,14 @@ async def initiate_request_status_update(callback: CallbackQuery, state: FSMCont
             await state.set_state(RequestResolution.waiting_for_pc_number)
         else:
             # Agar status "in_progress" bo'lsa, darhol yangilaymiz
-            request.status = new_status
-            request.resolved_by_user_id = technician.id # Kim bajarganini yozamiz
-            db.commit()
-            db.refresh(request)
+            await write_queue.submit(set_request_status, request_id, new_status, technician.id)
+            outbox.wake()
 
             await callback.message.edit_text(
                 f"✅ **Статус заявки #{request_id} обновлен на '{new_status.title()}'**"                "Пожалуйста, нажмите кнопку ниже или отправьте команду✅  /start ✅ повторно.",
                 reply_markup=None
             )
 
-            user_who_submitted = db.query(User).get(request.user_id)
-            if user_who_submitted:
-                await bot.send_message(
-                    user_who_submitted.telegram_id,
-                    f"🔔 Arizangiz #{request.id} yangilandi:\n\n"
-                    f"Status: **{new_status.title()}**.\n\n"
-                    f"Sabab: {request.reason}"
-                )
-
-        db.close()
         await callback.answer() # Callback queryga javob qaytarish
     except Exception as e:
         logging.error(f"Arizaning statusini yangilashda xato: {e}")
@@ -1284,7 +3349,7 @@ async def process_resolution_details(message: Message, state: FSMContext):
 
 
 @router.callback_query(StateFilter(RequestResolution.waiting_for_resolution_confirm))
-async def confirm_resolution_details(callback: CallbackQuery, state: FSMContext):
+async def confirm_resolution_details(callback: CallbackQuery, state: FSMContext, db: Session):
     data = await state.get_data()
     request_id = data['request_id']
     new_status = data['new_status']
@@ -1292,23 +3357,21 @@ async def confirm_resolution_details(callback: CallbackQuery, state: FSMContext)
     resolution_details = data['resolution_details']
     technician_id = data['technician_id']
 
-    db = SessionLocal()
-    request = db.query(Request).get(request_id)
-    technician = db.query(User).get(technician_id) # Texnik ma'lumotlarini olish
+    request = await run_db(db.get, Request, request_id)
+    technician = await run_db(db.get, User, technician_id) # Texnik ma'lumotlarini olish
 
     if not request:
         await callback.message.edit_text("Arizada xatolik topildi, u mavjud emas.", reply_markup=None)
         await state.clear()
-        db.close()
         return
 
     if callback.data == "confirm_yes":
-        request.status = new_status
-        request.pc_number = pc_number
-        request.resolution_details = resolution_details
-        request.resolved_by_user_id = technician_id # Kim bajarganini yozamiz
-        db.commit()
-        db.refresh(request)
+        await write_queue.submit(
+            set_request_status, request_id, new_status, technician_id,
+            pc_number=pc_number, resolution_details=resolution_details,
+            technician_name=technician.full_name if technician else None
+        )
+        outbox.wake()
 
         await callback.message.edit_text(
             f"✅ **Статус заявки #{request_id} обновлен на '{new_status.title()}'**\n\n"
@@ -1318,51 +3381,21 @@ async def confirm_resolution_details(callback: CallbackQuery, state: FSMContext)
             reply_markup=None
         )
 
-        user_who_submitted = db.query(User).get(request.user_id)
-        if user_who_submitted:
-            await bot.send_message(
-                user_who_submitted.telegram_id,
-                f"🔔 Arizangiz #{request.id} yangilandi:\n\n"
-                f"Status: **{new_status.title()}**.\n"
-                f"PC raqami: {pc_number or 'Mavjud emas'}\n"
-                f"Texnik izohi: {resolution_details}\n\n"
-                f"Sabab: {request.reason}"
-            )
-        # Adminlarga ham xabar yuborish
-        admins = db.query(User).filter(User.role == 'admin').all()
-        for admin in admins:
-            try:
-                await bot.send_message(
-                    admin.telegram_id,
-                    f"✅ Ariza bajarildi: #{request.id}\n\n"
-                    f"**Kim bajardi:** {technician.full_name if technician else 'Nomalum'}\n"
-                    f"**Status:** {new_status.title()}\n"
-                    f"**Uchrezhdeniye:** {request.institution}\n"
-                    f"**PC raqami:** {pc_number or 'Mavjud emas'}\n"
-                    f"**Sabab:** {request.reason}\n"
-                    f"**Izoh:** {resolution_details}"
-                )
-            except Exception as e:
-                logging.error(f"Administratorga ({admin.telegram_id}) xabar yuborishda xato: {e}")
-
     else:
         await callback.message.edit_text("❌ Arizani hal qilish bekor qilindi.", reply_markup=None)
 
-    db.close()
     await state.clear()
 
 
 # Obrabotchiki dlya polzovateley
 @router.message(F.text == "📋 Мои заявки")
-async def my_requests_handler(message: Message):
-    db = SessionLocal()
-    user = get_user_by_telegram_id(db, message.from_user.id)
+async def my_requests_handler(message: Message, db: Session):
+    user = await get_user_info(db, message.from_user.id)
     if not user:
         await message.answer("Пожалуйста, сначала зарегистрируйтесь используя /start.")
-        db.close()
         return
 
-    requests = db.query(Request).filter(Request.user_id == user.id).order_by(Request.created_at.desc()).limit(10).all()
+    requests = await run_db(get_user_requests, db, user.id)
 
     if not requests:
         await message.answer("Вы еще не отправляли заявок.")
@@ -1378,16 +3411,12 @@ async def my_requests_handler(message: Message):
             )
         await message.answer(response_text)
 
-    db.close()
-
 
 @router.message(F.text == "ℹ️ Профиль")
-async def profile_handler(message: Message):
-    db = SessionLocal()
-    user = get_user_by_telegram_id(db, message.from_user.id)
+async def profile_handler(message: Message, db: Session):
+    user = await get_user_info(db, message.from_user.id)
     if not user:
         await message.answer("Пожалуйста, сначала зарегистрируйтесь используя /start.")
-        db.close()
         return
 
     profile_text = (
@@ -1402,27 +3431,16 @@ async def profile_handler(message: Message):
     )
     await message.answer(profile_text)
 
-    db.close()
-
 
 @router.message(F.text == "📊 Моя статистика")
-async def technician_stats_handler(message: Message):
-    db = SessionLocal()
-    user = get_user_by_telegram_id(db, message.from_user.id)
+async def technician_stats_handler(message: Message, db: Session):
+    user = await get_user_info(db, message.from_user.id)
     if not user or user.role != 'technician':
         await message.answer("❌ У вас нет разрешения на это действие.")
-        db.close()
         return
 
-    total_requests_in_institution = db.query(Request).filter(Request.institution == user.institution).count()
-    completed = db.query(Request).filter(
-        Request.institution == user.institution,
-        Request.status == 'completed'
-    ).count()
-    in_progress = db.query(Request).filter(
-        Request.institution == user.institution,
-        Request.status == 'in_progress'
-    ).count()
+    total_requests_in_institution, completed, in_progress = await get_cached_stats(
+        ('institution', user.institution), get_institution_stats, db, user.institution)
 
     stats_text = (
         "📊 **Статистика по вашему учреждению**\n\n"
@@ -1432,43 +3450,90 @@ async def technician_stats_handler(message: Message):
     )
 
     await message.answer(stats_text)
-    db.close()
 
 
 # Obrabotchiki dlya administratora
 @router.message(F.text == "📋 Arizalarni ko'rish") # Matn o'zgartirildi
-async def admin_view_requests_handler(message: Message):
-    db = SessionLocal()
-    user = get_user_by_telegram_id(db, message.from_user.id)
+async def admin_view_requests_handler(message: Message, db: Session):
+    user = await get_user_info(db, message.from_user.id)
     if not user or user.role != 'admin':
         await message.answer("❌ У вас нет доступа к этому разделу.")
-        db.close()
         return
 
-    requests = db.query(Request).filter(
-        Request.status.in_(['pending', 'in_progress'])
-    ).order_by(Request.created_at.desc()).all()
+    text, keyboard = await render_admin_requests_page(db, 'a', 0, 0)
+    await message.answer(text, reply_markup=keyboard)
 
-    if not requests:
-        await message.answer("В системе нет активных заявок.")
-    else:
-        response_text = "📋 **Все активные заявки:**\n\n"
-        for req in requests:
-            response_text += (
-                f"🆔 **ID:** -- {req.id}\n"
-                f"🏢 **Учреждение:** {req.institution}\n"
-                f"📝 **Причина:** {req.reason}\n"
-                f"➡️ **Статус:** {req.status.title()}\n"
-                f"🗓️ **Дата:** {req.created_at.strftime('%Y-%m-%d %H:%M')}\n"
-                f"---\n\n"
-            )
-        await message.answer(response_text)
-    db.close()
+
+async def render_admin_requests_page(db: Session, status: str, region_id: int, district_id: int,
+                                     direction: str = 'f', cursor: Optional[str] = None) -> tuple:
+    region = geography.region_names.get(region_id) if region_id else None
+    district = geography.district_names.get(district_id) if district_id else None
+    rows, has_more = await run_db(
+        get_active_requests_page, db, config.REQUESTS_PAGE_SIZE,
+        status=ADMIN_STATUS_FILTERS[status], region=region, district=district,
+        cursor=decode_request_cursor(cursor) if cursor else None, newer=direction == 'n'
+    )
+    # Bir yo'nalishdagi davomini so'rov aytadi, qarama-qarshisini kelgan yo'nalish
+    has_older = has_more if direction != 'n' else True
+    has_newer = has_more if direction == 'n' else direction == 'o'
+
+    filters = [ADMIN_STATUS_LABELS[status]]
+    if region:
+        filters.append(region)
+    if district:
+        filters.append(district)
+    response_text = f"📋 **Активные заявки** ({', '.join(filters)})\n\n"
+    if not rows:
+        response_text += "В системе нет активных заявок." if direction == 'f' else "Больше заявок нет."
+    for req, _ in rows:
+        reason = req.reason if len(req.reason) <= 100 else req.reason[:100] + '...'
+        response_text += (
+            f"🆔 **ID:** -- {req.id}\n"
+            f"🏢 **Учреждение:** {req.institution}\n"
+            f"📝 **Причина:** {reason}\n"
+            f"➡️ **Статус:** {req.status.title()}\n"
+            f"🗓️ **Дата:** {req.created_at.strftime('%Y-%m-%d %H:%M')}\n"
+            f"---\n\n"
+        )
+    keyboard = create_admin_requests_keyboard(status, region_id, district_id, rows, has_older, has_newer)
+    return response_text, keyboard
+
+
+@router.callback_query(F.data.startswith("areq:"))
+async def admin_requests_page_callback(callback: CallbackQuery, db: Session):
+    user = await get_user_info(db, callback.from_user.id)
+    if not user or user.role != 'admin':
+        await callback.answer("❌ У вас нет доступа к этому разделу.", show_alert=True)
+        return
+
+    _, status, region_id, district_id, direction, cursor = callback.data.split(':', 5)
+    text, keyboard = await render_admin_requests_page(
+        db, status, int(region_id), int(district_id), direction, cursor or None)
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except TelegramBadRequest as e:
+        # Sahifa o'zgarmagan bo'lsa Telegram "message is not modified" qaytaradi
+        if "message is not modified" not in str(e):
+            raise
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("areqf:"))
+async def admin_requests_filter_callback(callback: CallbackQuery, db: Session):
+    user = await get_user_info(db, callback.from_user.id)
+    if not user or user.role != 'admin':
+        await callback.answer("❌ У вас нет доступа к этому разделу.", show_alert=True)
+        return
+
+    _, kind, status, region_id, district_id = callback.data.split(':')
+    await callback.message.edit_reply_markup(
+        reply_markup=create_admin_requests_filter_keyboard(kind, status, int(region_id), int(district_id)))
+    await callback.answer()
 
 
 @router.message(F.text == "📊 Hisobotlar") # Matn o'zgartirildi
-async def admin_reports_handler(message: Message):
-    await generate_report_handler(message)
+async def admin_reports_handler(message: Message, db: Session):
+    await generate_report_handler(message, db)
 
 
 @router.message(F.text == "🔧 Texniklarni boshqarish") # Matn o'zgartirildi
@@ -1501,12 +3566,10 @@ async def cancel_add_technician(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(StateFilter(AdminAddTechnician.waiting_for_telegram_id), F.text)
-async def admin_process_technician_id(message: Message, state: FSMContext):
+async def admin_process_technician_id(message: Message, state: FSMContext, db: Session):
     try:
         telegram_id = int(message.text)
-        db = SessionLocal()
-        user = get_user_by_telegram_id(db, telegram_id)
-        db.close()
+        user = await get_user_info(db, telegram_id)
 
         if user:
             await message.answer(
@@ -1597,7 +3660,7 @@ async def admin_process_tech_district(message: Message, state: FSMContext):
     await state.set_state(AdminAddTechnician.waiting_for_institution)
 
 @router.message(StateFilter(AdminAddTechnician.waiting_for_institution), F.text)
-async def admin_process_tech_institution(message: Message, state: FSMContext):
+async def admin_process_tech_institution(message: Message, state: FSMContext, db: Session):
     if message.text == "Отмена":
         await state.clear()
         await message.answer("Texnik qo'shish bekor qilindi.", reply_markup=create_admin_keyboard())
@@ -1612,23 +3675,17 @@ async def admin_process_tech_institution(message: Message, state: FSMContext):
     institution = message.text
 
     # Muassasa mavjudligini tekshirish
-    db = SessionLocal()
     try:
-        institution_exists = db.query(Institution).join(District).filter(
-            Institution.name == institution,
-            District.name == district
-        ).first()
-
-        if not institution_exists:
+        if (district, institution) not in geography.institutions:
             await message.answer(
                 f"❌ Muassasa '{institution}' {district} tumanida topilmadi. Iltimos, ro'yxatdan tanlang.",
                 reply_markup=create_institutions_keyboard(district)
             )
-            db.close()
             return
 
         # Yangi texnikni yaratish
-        new_technician = create_user(
+        new_technician = await run_db(
+            create_user,
             db=db,
             telegram_id=telegram_id,
             region=region,
@@ -1636,10 +3693,9 @@ async def admin_process_tech_institution(message: Message, state: FSMContext):
             institution=institution,
             full_name=full_name,
             position="Texnik",
-            role="technician"
+            role="technician",
+            phone_number=phone_number
         )
-        new_technician.phone_number = phone_number
-        db.commit()
 
         # Muvaffaqiyatli xabar
         await message.answer(
@@ -1676,14 +3732,11 @@ async def admin_process_tech_institution(message: Message, state: FSMContext):
             reply_markup=create_admin_keyboard()
         )
     finally:
-        db.close()
         await state.clear()
 
 @router.callback_query(F.data == "admin_delete_tech")
-async def admin_delete_technician_start(callback: CallbackQuery):
-    db = SessionLocal()
-    technicians = db.query(User).filter(User.role == 'technician').all()
-    db.close()
+async def admin_delete_technician_start(callback: CallbackQuery, db: Session):
+    technicians = await run_db(db.query(User).filter(User.role == 'technician').all)
 
     if not technicians:
         await callback.message.edit_text("Tizimda ro'yxatdan o'tgan texniklar yo'q.", reply_markup=None) # Matn o'zgartirildi
@@ -1698,15 +3751,12 @@ async def admin_delete_technician_start(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("delete_tech_"))
-async def admin_delete_technician(callback: CallbackQuery):
+async def admin_delete_technician(callback: CallbackQuery, db: Session):
     try:
         technician_id = int(callback.data.split('_')[2])
-        db = SessionLocal()
-        technician = db.query(User).get(technician_id)
+        technician = await run_db(delete_user, db, technician_id)
 
         if technician:
-            db.delete(technician)
-            db.commit()
             await callback.message.edit_text(
                 f"✅ Texnik **{technician.full_name}** muvaffaqiyatli o'chirildi.", # Matn o'zgartirildi
                 reply_markup=None
@@ -1714,7 +3764,6 @@ async def admin_delete_technician(callback: CallbackQuery):
         else:
             await callback.message.edit_text("❌ Texnik topilmadi.", reply_markup=None) # Matn o'zgartirildi
 
-        db.close()
         await callback.answer()
     except Exception as e:
         await callback.message.answer(f"O'chirishda xatolik yuz berdi: {str(e)}") # Matn o'zgartirildi
@@ -1728,20 +3777,19 @@ async def cancel_delete_technician(callback: CallbackQuery):
 
 # Administrator handlerlari qismida
 @router.message(F.text == "👥 Foydalanuvchi & Texniklar soni")
-async def admin_users_and_techs_count_handler(message: Message):
-    db = SessionLocal()
-    user = get_user_by_telegram_id(db, message.from_user.id)
+async def admin_users_and_techs_count_handler(message: Message, db: Session):
+    user = await get_user_info(db, message.from_user.id)
     if not user or user.role != 'admin':
         await message.answer("❌ Sizda bu bo'limga kirishga ruxsat yo'q.")
-        db.close()
         return
 
     try: # Qo'shimcha try-except bloki qo'shish
-        total_users = db.query(User).filter(User.role == 'user').count()
-        total_technicians = db.query(User).filter(User.role == 'technician').count()
-        total_active_requests = db.query(Request).filter(Request.status.in_(['pending', 'in_progress'])).count()
-        total_completed_requests = db.query(Request).filter(Request.status == 'completed').count()
-        total_requests_all = db.query(Request).count()
+        stats = await get_cached_stats('system', get_system_stats, db)
+        total_users = stats['users']
+        total_technicians = stats['technicians']
+        total_active_requests = stats['active_requests']
+        total_completed_requests = stats['completed_requests']
+        total_requests_all = stats['all_requests']
 
         stats_text = (
             "📊 **Tizim statistikasi:**\n\n"
@@ -1757,8 +3805,6 @@ async def admin_users_and_techs_count_handler(message: Message):
         # Agar xato bo'lsa, uni logga yozamiz va foydalanuvchiga xabar beramiz
         logging.error(f"Statistika olishda xato yuz berdi: {e}")
         await message.answer("❌ Statistik ma'lumotlarni olishda xatolik yuz berdi. Iltimos, keyinroq urinib ko'ring.")
-    finally:
-        db.close() # Har doim db ulanishini yopishni unutmang
 
 @router.message(F.text == "🏢 Ma'lumotlarni boshqarish") # Matn o'zgartirildi
 async def admin_manage_data_handler(message: Message):
@@ -1798,18 +3844,16 @@ async def process_add_institution_region(message: Message, state: FSMContext):
         await message.answer("Harakat bekor qilindi.", reply_markup=create_admin_keyboard()) # Matn o'zgartirildi
         return
 
-    db = SessionLocal()
-    region = db.query(Region).filter(Region.name == message.text).first()
-    db.close()
+    region_id = geography.region_ids.get(message.text)
 
-    if not region:
+    if not region_id:
         await message.answer(
             "❌ Tanlangan mintaqa topilmadi. Iltimos, ro'yxatdan tanlang.", # Matn o'zgartirildi
             reply_markup=create_regions_keyboard()
         )
         return
 
-    await state.update_data(region_id=region.id, region_name=message.text)
+    await state.update_data(region_id=region_id, region_name=message.text)
     await message.answer(
         f"Tanlangan mintaqa: {message.text}\n\n" # Matn o'zgartirildi
         "Endi, iltimos, tumanni tanlang:", # Matn o'zgartirildi
@@ -1828,21 +3872,16 @@ async def process_add_institution_district(message: Message, state: FSMContext):
     region_id = data.get('region_id')
     district_name = message.text
 
-    db = SessionLocal()
-    district = db.query(District).filter(
-        District.name == district_name,
-        District.region_id == region_id
-    ).first()
-    db.close()
+    district_id = geography.district_ids.get((region_id, district_name))
 
-    if not district:
+    if not district_id:
         await message.answer(
             "❌ Tanlangan tuman bu mintaqada topilmadi. Iltimos, ro'yxatdan tanlang.", # Matn o'zgartirildi
             reply_markup=create_districts_keyboard(data.get('region_name'))
         )
         return
 
-    await state.update_data(district_id=district.id)
+    await state.update_data(district_id=district_id)
     await message.answer(
         f"Tanlangan tuman: {district_name}\n\n" # Matn o'zgartirildi
         "Iltimos, yangi muassasaning nomini kiriting:", # Matn o'zgartirildi
@@ -1851,7 +3890,7 @@ async def process_add_institution_district(message: Message, state: FSMContext):
     await state.set_state(AdminAddInstitution.waiting_for_name)
 
 @router.message(StateFilter(AdminAddInstitution.waiting_for_name), F.text)
-async def process_add_institution_name(message: Message, state: FSMContext):
+async def process_add_institution_name(message: Message, state: FSMContext, db: Session):
     if message.text == "Отмена":
         await state.clear()
         await message.answer("Harakat bekor qilindi.", reply_markup=create_admin_keyboard()) # Matn o'zgartirildi
@@ -1862,17 +3901,13 @@ async def process_add_institution_name(message: Message, state: FSMContext):
     institution_name = message.text
 
     try:
-        db = SessionLocal()
-        new_institution = Institution(name=institution_name, district_id=district_id)
-        db.add(new_institution)
-        db.commit()
+        await run_db(add_institution, db, institution_name, district_id)
 
         await message.answer(
             f"✅ Muassasa **{institution_name}** muvaffaqiyatli qo'shildi!", # Matn o'zgartirildi
             reply_markup=create_admin_keyboard()
         )
 
-        db.close()
         await state.clear()
 
     except Exception as e:
@@ -1885,12 +3920,10 @@ async def process_add_institution_name(message: Message, state: FSMContext):
         await state.clear()
 
 @router.callback_query(F.data == "delete_institution")
-async def delete_institution_start(callback: CallbackQuery):
-    db = SessionLocal()
+async def delete_institution_start(callback: CallbackQuery, db: Session):
 
     # ИСПРАВЛЕНО: получаем учреждения вместе с районами, к которым они относятся
-    institutions_with_districts = db.query(Institution, District.name).join(District).all()
-    db.close()
+    institutions_with_districts = await run_db(get_institutions_with_districts, db)
 
     if not institutions_with_districts:
         await callback.message.edit_text("Tizimda ro'yxatdan o'tgan muassasalar yo'q.", reply_markup=None) # Matn o'zgartirildi
@@ -1905,15 +3938,12 @@ async def delete_institution_start(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("delete_inst_"))
-async def delete_institution(callback: CallbackQuery):
+async def delete_institution(callback: CallbackQuery, db: Session):
     try:
         institution_id = int(callback.data.split('_')[2])
-        db = SessionLocal()
-        institution = db.query(Institution).get(institution_id)
+        institution = await run_db(remove_institution, db, institution_id)
 
         if institution:
-            db.delete(institution)
-            db.commit()
             await callback.message.edit_text(
                 f"✅ Muassasa **{institution.name}** muvaffaqiyatli o'chirildi.", # Matn o'zgartirildi
                 reply_markup=None
@@ -1921,7 +3951,6 @@ async def delete_institution(callback: CallbackQuery):
         else:
             await callback.message.edit_text("❌ Muassasa topilmadi.", reply_markup=None) # Matn o'zgartirildi
 
-        db.close()
         await callback.answer()
     except Exception as e:
         await callback.message.answer(f"O'chirishda xatolik yuz berdi: {str(e)}") # Matn o'zgartirildi
@@ -1962,7 +3991,7 @@ async def super_admin_add_admin_start(message: Message, state: FSMContext):
 
 
 @router.message(StateFilter(SuperAdminAddAdmin.waiting_for_admin_telegram_id), F.text)
-async def process_new_admin_telegram_id(message: Message, state: FSMContext):
+async def process_new_admin_telegram_id(message: Message, state: FSMContext, db: Session):
     if message.text.lower() == "bekor qilish":
         await state.clear()
         await message.answer("Admin qo'shish bekor qilindi.", reply_markup=create_admin_keyboard())
@@ -1970,14 +3999,12 @@ async def process_new_admin_telegram_id(message: Message, state: FSMContext):
 
     try:
         telegram_id = int(message.text)
-        db = SessionLocal()
-        user = get_user_by_telegram_id(db, telegram_id)
+        user = await run_db(get_user_by_telegram_id, db, telegram_id)
 
         if user:
             # Agar foydalanuvchi mavjud bo'lsa, uning rolini o'zgartiramiz
             if user.role != 'admin':
-                user.role = 'admin'
-                db.commit()
+                await run_db(set_user_role, db, user, 'admin')
                 await message.answer(
                     f"✅ Foydalanuvchi **{user.full_name}** ({telegram_id}) muvaffaqiyatli admin roliga o'tkazildi!",
                     reply_markup=create_admin_keyboard()
@@ -1997,7 +4024,6 @@ async def process_new_admin_telegram_id(message: Message, state: FSMContext):
                 reply_markup=ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text="Bekor qilish")]], resize_keyboard=True)
             )
             await state.set_state(SuperAdminAddAdmin.waiting_for_admin_full_name)
-        db.close()
 
     except ValueError:
         await message.answer(
@@ -2007,7 +4033,7 @@ async def process_new_admin_telegram_id(message: Message, state: FSMContext):
 
 
 @router.message(StateFilter(SuperAdminAddAdmin.waiting_for_admin_full_name), F.text)
-async def process_new_admin_full_name(message: Message, state: FSMContext):
+async def process_new_admin_full_name(message: Message, state: FSMContext, db: Session):
     if message.text.lower() == "bekor qilish":
         await state.clear()
         await message.answer("Admin qo'shish bekor qilindi.", reply_markup=create_admin_keyboard())
@@ -2017,8 +4043,8 @@ async def process_new_admin_full_name(message: Message, state: FSMContext):
     telegram_id = data.get('new_admin_telegram_id')
     full_name = message.text
 
-    db = SessionLocal()
-    new_admin = create_user(
+    new_admin = await run_db(
+        create_user,
         db=db,
         telegram_id=telegram_id,
         region="Admin", # Adminlar uchun o'ziga xos region, district, institution
@@ -2028,7 +4054,6 @@ async def process_new_admin_full_name(message: Message, state: FSMContext):
         position="Administrator",
         role="admin"
     )
-    db.close()
     await state.clear()
 
     await message.answer(
@@ -2042,14 +4067,214 @@ async def process_new_admin_full_name(message: Message, state: FSMContext):
 
 
 # Glavnaya funktsiya dlya zapuska bota
-async def main():
+async def main(worker_id: int = 0):
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s - %(levelname)s - w{worker_id} - %(name)s - %(message)s")
+    # Bir nechta worker'da boshlang'ich ma'lumotlar run_workers() ichida bir marta yoziladi
+    if config.WORKERS == 1:
+        await run_db(initialize_sample_data)
+    await run_db(geography.reload)
+    await run_db(with_session, routing.load)
+    await run_db(with_session, blocked_chats.load)
+    dp.update.outer_middleware(ConcurrencyLimitMiddleware(config.MAX_CONCURRENT_UPDATES))
+    if config.USE_WEBHOOK:
+        dp.update.outer_middleware(UpdateDedupMiddleware(config.UPDATE_DEDUP_HOURS))
+    dp.update.outer_middleware(DbSessionMiddleware())
+    dp.include_router(router)
+    await fsm_storage.start()
+    await write_queue.start()
+    if config.WORKERS > 1:
+        await cache_sync.start()
+    if worker_id == 0:
+        await notifier.start()
+        await outbox.start()
+    try:
+        if config.USE_WEBHOOK:
+            await run_webhook(set_webhook=worker_id == 0)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        await write_queue.stop()
+        if worker_id == 0:
+            await outbox.stop()
+            await notifier.stop()
+        await cache_sync.stop()
+        await fsm_storage.close()
+        report_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run_worker(worker_id: int) -> None:
+    try:
+        asyncio.run(main(worker_id))
+    except KeyboardInterrupt:
+        pass
+
+
+def run_workers() -> None:
+    """config.WORKERS ta jarayon: har biri o'z event loop'i bilan bitta webhook portini
+    SO_REUSEPORT orqali tinglaydi, yadro ulanishlarni ular o'rtasida taqsimlaydi.
+    Umumiy holat (FSM, keshlar versiyasi, update_id'lar, outbox) SQLite bazasida."""
     logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(name)s - %(message)s")
     initialize_sample_data()
-    dp.include_router(router)
-    await dp.start_polling(bot)
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=run_worker, args=(worker_id,), name=f"bot-worker-{worker_id}")
+        for worker_id in range(config.WORKERS)
+    ]
+    for process in processes:
+        process.start()
+    logging.info(f"{len(processes)} ta worker ishga tushirildi")
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Ctrl+C worker'larga ham yetib boradi, ular o'zi to'xtaydi
+        for process in processes:
+            process.join()
+
+
+async def run_webhook(set_webhook: bool = True):
+    """Update'larni Telegram webhook orqali qabul qiluvchi aiohttp server"""
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot, handle_in_background=True, secret_token=config.WEBHOOK_SECRET or None
+    ).register(app, path=config.WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    if set_webhook and config.WEBHOOK_BASE_URL:
+        await bot.set_webhook(
+            f"{config.WEBHOOK_BASE_URL.rstrip('/')}{config.WEBHOOK_PATH}",
+            secret_token=config.WEBHOOK_SECRET or None,
+            max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, config.WEBAPP_HOST, config.WEBAPP_PORT, reuse_port=config.WORKERS > 1).start()
+    logging.info(f"Webhook {config.WEBAPP_HOST}:{config.WEBAPP_PORT}{config.WEBHOOK_PATH} manzilida tinglanmoqda")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def send_test_updates(text: str, user_id: int, count: int = 1):
+    """Lokal webhook'ni tekshirish: Telegram formatidagi soxta xabarlarni serverga yuboradi.
+
+    python main.py test-webhook "/start" 584323689 10
+    """
+    url = f"http://127.0.0.1:{config.WEBAPP_PORT}{config.WEBHOOK_PATH}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": config.WEBHOOK_SECRET} if config.WEBHOOK_SECRET else {}
+    base_id = int(time.time() * 1000)
+    async with ClientSession() as session:
+        for i in range(count):
+            update = {
+                "update_id": base_id + i,
+                "message": {
+                    "message_id": i + 1,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+                    "text": text,
+                },
+            }
+            async with session.post(url, json=update, headers=headers) as response:
+                print(f"update {update['update_id']}: HTTP {response.status}")
+
+
+def benchmark_db(seconds: float = 5.0, readers: int = 2, writers: int = 4, rows: int = 20000) -> None:
+    """Hisobot o'qishlari va ariza yozuvlari parallel bajarilganda o'tkazuvchanlik: standart
+    SQLite sozlamalari va config profili bilan. Bazaning nusxasida ishlaydi.
+
+    python main.py bench-db 5
+    """
+    source = sqlite3.connect(engine.url.database)
+    work_dir = tempfile.mkdtemp(prefix="bench-db-")
+    seed_path = os.path.join(work_dir, "seed.db")
+    seed = sqlite3.connect(seed_path)
+    source.backup(seed)
+    source.close()
+    seed.execute("PRAGMA journal_mode=DELETE")
+    user_id, region, district, institution = seed.execute(
+        "SELECT id, region, district, institution FROM users ORDER BY id LIMIT 1"
+    ).fetchone()
+    now = datetime.now()
+    seed.executemany(
+        "INSERT INTO requests (user_id, region, district, institution, reason, floor_room, submitted_by, "
+        "status, created_at, updated_at) VALUES (?, ?, ?, ?, 'bench', '1', 'bench', 'pending', ?, ?)",
+        [(user_id, region, district, institution, now - timedelta(minutes=i), now - timedelta(minutes=i))
+         for i in range(rows)]
+    )
+    seed.commit()
+    seed.close()
+    data = dict(region=region, district=district, institution=institution,
+                reason="bench", floor_room="1", submitted_by="bench")
+    start, end = now - timedelta(days=365), now
+
+    profiles = [("standart", {'journal_mode': 'DELETE'}), ("profil", sqlite_pragmas())]
+    for name, pragmas in profiles:
+        path = os.path.join(work_dir, f"{name}.db")
+        shutil.copy(seed_path, path)
+        bench_engine = create_db_engine(f"sqlite:///{path}", pragmas)
+        bench_session = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=bench_engine)
+        counts = {'read': 0, 'write': 0, 'locked': 0}
+        counts_lock = threading.Lock()
+        deadline = time.monotonic() + seconds
+
+        def record(key):
+            with counts_lock:
+                counts[key] += 1
+
+        def reader():
+            while time.monotonic() < deadline:
+                db = bench_session()
+                try:
+                    sum(1 for _ in iter_report_rows(db, start, end, config.REPORT_TABLE_ROWS))
+                    record('read')
+                except OperationalError:
+                    record('locked')
+                finally:
+                    db.close()
+
+        def writer():
+            while time.monotonic() < deadline:
+                db = bench_session()
+                try:
+                    [(ok, value)] = apply_write_batch(db, [(create_request, (user_id, data, "bench"), {})])
+                    if not ok:
+                        raise value
+                    record('write')
+                except OperationalError:
+                    record('locked')
+                finally:
+                    db.close()
+
+        threads = [threading.Thread(target=reader) for _ in range(readers)]
+        threads += [threading.Thread(target=writer) for _ in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        bench_engine.dispose()
+        print(f"{name:>9}: {counts['read'] / seconds:8.1f} hisobot/s  {counts['write'] / seconds:8.1f} ariza/s  "
+              f"'database is locked': {counts['locked']}")
+    shutil.rmtree(work_dir, ignore_errors=True)
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bench-db":
+        benchmark_db(float(sys.argv[2]) if len(sys.argv) > 2 else 5.0)
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "test-webhook":
+        asyncio.run(send_test_updates(
+            sys.argv[2] if len(sys.argv) > 2 else "/start",
+            int(sys.argv[3]) if len(sys.argv) > 3 else config.ADMIN_IDS[0],
+            int(sys.argv[4]) if len(sys.argv) > 4 else 1,
+        ))
+        sys.exit(0)
+    if config.WORKERS > 1:
+        run_workers()
+        sys.exit(0)
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="session")
+def main_module(tmp_path_factory):
+    # main import paytida joriy papkada requests.db va reports/ yaratadi - vaqtinchalik papkada
+    workdir = tmp_path_factory.mktemp("app")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    try:
+        import main
+        yield main
+    finally:
+        sys.path.remove(ROOT)
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def make_engine(main_module, tmp_path):
+    """Vaqtinchalik faylda create_all va MIGRATIONS qo'llangan engine"""
+    engines = []
+
+    def make(name="test.db"):
+        engine = main_module.create_db_engine(f"sqlite:///{tmp_path / name}", main_module.sqlite_pragmas())
+        main_module.Base.metadata.create_all(engine)
+        main_module.run_migrations(engine)
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.dispose()
@@ -0,0 +1,68 @@
+"""Tahlil hisob-kitoblari va ularning PDF hisobotdagi ko'rinishi."""
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+
+def sample_frame(main):
+    rows = [
+        # tuman, muassasa, texnik id, javob soati, hal qilish soati, yoshi (soat)
+        ("D1", "I1", 1, 1.0, 10.0, 100.0),
+        ("D1", "I1", 1, 2.0, 30.0, 100.0),
+        ("D1", "I2", 2, 5.0, None, 50.0),
+        ("D2", "I3", None, None, None, 2.0),
+    ]
+    frame = pd.DataFrame.from_records(rows, columns=main.ANALYTICS_COLUMNS)
+    frame['technician'] = frame['resolved_by_user_id'].map({1: "Tex A", 2: "Tex B"})
+    return frame
+
+
+def test_analytics_section_prints_counts_as_integers(main_module, make_engine):
+    main = main_module
+    end = datetime(2026, 1, 31)
+    analytics = main.compute_request_analytics(sample_frame(main), end - timedelta(days=30), end, 4.0, 24.0)
+    assert analytics['overall']['requests'] == 4
+    assert analytics['technicians'].loc["Tex A", 'resolved'] == 2
+
+    db = main.SessionLocal(bind=make_engine())
+    try:
+        story = main.PDFReportGenerator(db).analytics_section(analytics)
+    finally:
+        db.close()
+    tables = [item for item in story if isinstance(item, main.Table)]
+    districts, technicians = tables[1]._cellvalues, tables[3]._cellvalues
+    assert ["D1", "3"] == districts[1][:2]
+    assert ["Tex A", "2"] == technicians[1][:2]
+
+
+def test_load_request_frame_durations(main_module, make_engine):
+    main = main_module
+    db = main.SessionLocal(bind=make_engine())
+    try:
+        tech = main.User(telegram_id=2001, region="R", district="D", institution="I", full_name="Tex A",
+                         position="P", role='technician')
+        db.add(tech)
+        db.flush()
+        created = datetime(2026, 1, 10, 8, 0, 0, 250000)
+        common = dict(user_id=tech.id, region="R", institution="I", reason="r", floor_room="1", submitted_by="s")
+        db.add_all([
+            main.Request(district="D1", created_at=created, first_response_at=created + timedelta(hours=1, minutes=30),
+                         resolved_at=created + timedelta(hours=12), resolved_by_user_id=tech.id, **common),
+            main.Request(district="D2", created_at=created + timedelta(days=1), **common),
+            # Davrdan tashqarida
+            main.Request(district="D3", created_at=created - timedelta(days=30), **common),
+        ])
+        # created_at'ni func.now() (CURRENT_TIMESTAMP) formatida, mikrosekundlarsiz yozish
+        db.add(main.Request(district="D4", **common))
+        db.commit()
+
+        frame = main.load_request_frame(db, datetime(2026, 1, 1), datetime(2100, 1, 1)).set_index('district')
+    finally:
+        db.close()
+
+    assert sorted(frame.index) == ["D1", "D2", "D4"]
+    assert frame.loc["D1", 'response_hours'] == 1.5
+    assert frame.loc["D1", 'resolution_hours'] == 12.0
+    assert frame.loc["D1", 'technician'] == "Tex A"
+    assert pd.isna(frame.loc["D2", 'response_hours']) and pd.isna(frame.loc["D2", 'resolution_hours'])
+    assert 0 <= frame.loc["D4", 'age_hours'] < 1
@@ -0,0 +1,50 @@
+"""Muvaffaqiyatsiz outbox xabarlari darhol emas, eksponensial kutishdan keyin qayta olinadi."""
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def db(main_module, make_engine):
+    session = main_module.SessionLocal(bind=make_engine())
+    yield session
+    session.close()
+
+
+def test_outbox_retry_delay_doubles_up_to_cap(main_module):
+    delays = [main_module.outbox_retry_delay(attempts, 30.0, 200.0) for attempts in range(1, 6)]
+    assert delays == [30.0, 60.0, 120.0, 200.0, 200.0]
+
+
+def test_failed_send_is_not_refetched_until_due(main_module, db):
+    main = main_module
+    message = main.OutboxMessage(chat_id=1, text="salom")
+    db.add(message)
+    db.commit()
+
+    before = datetime.now()
+    main.mark_outbox_results(db, [(message.id, False)], 5, 30.0, 3600.0)
+    db.refresh(message)
+    assert message.status == 'pending' and message.attempts == 1
+    assert before + timedelta(seconds=30) <= message.next_attempt_at <= datetime.now() + timedelta(seconds=30)
+    assert main.fetch_pending_outbox(db, 10, []) == []
+
+    # Ikkinchi muvaffaqiyatsizlik kutishni ikki baravar oshiradi
+    message.next_attempt_at = datetime.now() - timedelta(seconds=1)
+    db.commit()
+    assert [row.id for row in main.fetch_pending_outbox(db, 10, [])] == [message.id]
+    before = datetime.now()
+    main.mark_outbox_results(db, [(message.id, False)], 5, 30.0, 3600.0)
+    db.refresh(message)
+    assert message.attempts == 2
+    assert message.next_attempt_at >= before + timedelta(seconds=60)
+
+
+def test_requeue_clears_backoff(main_module, db):
+    main = main_module
+    message = main.OutboxMessage(chat_id=1, text="salom", status='failed', attempts=5,
+                                 next_attempt_at=datetime.now() + timedelta(hours=1))
+    db.add(message)
+    db.commit()
+    assert main.requeue_failed_outbox(db) == 1
+    assert [row.id for row in main.fetch_pending_outbox(db, 10, [])] == [message.id]
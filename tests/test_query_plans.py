@@ -0,0 +1,48 @@
+"""Asosiy so'rovlar SQLite'da kerakli indeks bo'yicha, vaqtinchalik saralashsiz bajarilishini tekshiradi."""
+from datetime import datetime, timedelta
+
+import pytest
+
+EXPECTED_INDEXES = {
+    'texnik arizalari': 'ix_requests_institution_status_created',
+    'muassasa statistikasi': 'ix_requests_institution_status_created',
+    'faol arizalar': 'ix_requests_status_created',
+    'faol arizalar (mintaqa)': 'ix_requests_status_region_created',
+    'faol arizalar (tuman)': 'ix_requests_status_region_district_created',
+    'foydalanuvchi arizalari': 'ix_requests_user_created',
+    'haftalik hisobot': 'ix_requests_created_at',
+    'tuman nomi': 'ix_districts_name',
+    'muassasa nomi': 'ix_institutions_name',
+}
+
+
+@pytest.fixture(params=["bo'sh", "ANALYZE"])
+def db(main_module, make_engine, request):
+    main = main_module
+    session = main.SessionLocal(bind=make_engine())
+    if request.param == "ANALYZE":
+        # Statistika bilan rejalovchi boshqa indeks tanlamasligi kerak
+        now = datetime.now()
+        statuses = ['pending', 'in_progress', 'completed', 'not_completed']
+        session.add_all(
+            main.Request(
+                user_id=i % 50, region=f"R{i % 5}", district=f"D{i % 20}", institution=f"I{i % 100}",
+                reason="test", floor_room="1", submitted_by="test", status=statuses[i % 4],
+                created_at=now - timedelta(hours=i)
+            )
+            for i in range(2000)
+        )
+        session.commit()
+        session.execute(main.text("ANALYZE"))
+        session.commit()
+    yield session
+    session.close()
+
+
+def test_query_plans_use_expected_indexes(main_module, db):
+    plans = main_module.explain_query_plans(db)
+    assert set(plans) == set(EXPECTED_INDEXES)
+    for name, index in EXPECTED_INDEXES.items():
+        plan = " | ".join(plans[name])
+        assert f"INDEX {index} " in plan, f"{name}: {plan}"
+        assert "TEMP B-TREE" not in plan, f"{name}: {plan}"
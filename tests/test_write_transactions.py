@@ -0,0 +1,80 @@
+"""O'qib-keyin-yozadigan sessiyalar boshqa ulanish oradagi commit'idan keyin ham yoza olishini tekshiradi."""
+import pytest
+
+
+@pytest.fixture
+def sessions(main_module, make_engine):
+    main = main_module
+    engine = make_engine()
+    factory = main.sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+    seed = factory()
+    user = main.User(telegram_id=1001, region="R", district="D", institution="I", full_name="Test",
+                     position="P", role='user')
+    seed.add(user)
+    seed.flush()
+    request = main.Request(user_id=user.id, region="R", district="D", institution="I", reason="test",
+                           floor_room="1", submitted_by="test")
+    seed.add(request)
+    seed.commit()
+    seed.close()
+    opened = []
+
+    def open_session():
+        session = factory()
+        opened.append(session)
+        return session
+
+    yield open_session, user.id, request.id
+    for session in opened:
+        session.close()
+
+
+def concurrent_commit(main, session):
+    # Boshqa ulanishdan yozuv (FSM holati), birinchi sessiyaning o'qishi va yozuvi orasida
+    main.begin_write(session)
+    main.save_fsm_records(session, [("fsm:test", None, {"a": 1}, main.datetime.now())])
+
+
+def test_handler_session_writes_after_concurrent_commit(main_module, sessions):
+    main = main_module
+    open_session, user_id, request_id = sessions
+    reader = open_session()
+    assert reader.get(main.Request, request_id) is not None
+    user = reader.get(main.User, user_id)
+
+    concurrent_commit(main, open_session())
+
+    main.set_user_role(reader, user, 'technician')
+    assert open_session().get(main.User, user_id).role == 'technician'
+
+
+def test_write_batch_after_concurrent_commit(main_module, sessions):
+    main = main_module
+    open_session, user_id, request_id = sessions
+    batch = open_session()
+    assert batch.get(main.Request, request_id) is not None
+
+    concurrent_commit(main, open_session())
+
+    [(ok, value)] = main.apply_write_batch(batch, [(main.set_request_status, (request_id, 'in_progress', user_id), {})])
+    assert ok, value
+    assert open_session().get(main.Request, request_id).status == 'in_progress'
+
+
+def test_write_batch_commits_once(main_module, sessions):
+    main = main_module
+    open_session, user_id, request_id = sessions
+    counts = []
+
+    def observe(db):
+        counts.append(open_session().query(main.RequestEvent).count())
+
+    batch = open_session()
+    main.apply_write_batch(batch, [
+        (main.set_request_status, (request_id, 'in_progress', user_id), {}),
+        (observe, (), {}),
+        (main.set_request_status, (request_id, 'completed', user_id), {}),
+        (observe, (), {}),
+    ])
+    assert counts == [0, 0]
+    assert open_session().query(main.RequestEvent).count() == 2